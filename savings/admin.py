@@ -1,10 +1,10 @@
 from django.contrib import admin
 from . import models
-from computedfields.models import update_dependent
 
 
 def update_APRs(modeladmin, request, queryset):
-    update_dependent(models.Balance.objects.filter(account__in=queryset))
+    updated = models.Balance.objects.filter(account__in=queryset).recompute()
+    modeladmin.message_user(request, f"Recalculated {updated} balances")
 
 
 update_APRs.short_description = "Update Calculated APR"
@@ -19,22 +19,27 @@ class AccountAdmin(admin.ModelAdmin):
         'total_topup_localized',
         'average_APR_localized',
         'returns_localized',
-        'balance_OK'
+        'balance_OK_localized'
     ]
     list_display = [
         'bank_name',
         'account_name',
         'current_balance_localized',
         'average_APR_localized',
-        'balance_OK'
+        'balance_OK_localized'
     ]
 
     actions = [update_APRs]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_summary()
+
 
 class BalanceAdmin(admin.ModelAdmin):
     """Admin registration for the Balance model"""
     readonly_fields = ['days_since_last_check', 'APR_localized']
+    # Each row is named after its account
+    list_select_related = ['account']
 
 
 admin.site.register(models.Account, AccountAdmin)
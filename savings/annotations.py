@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import datetime
+from decimal import Decimal
+from typing import List, Optional, Sequence
+
+from django.conf import settings
+from django.db import models as db
+
+from . import models
+from .loader import epoch_ms
+
+# Events Grafana can overlay on panels
+KINDS = ('topups', 'limits')
+
+
+def topups(start: Optional[datetime.date], end: Optional[datetime.date],
+           filters: Sequence[models.AccountFilter] = ()) -> List[dict]:
+    """An event for every topup and withdrawal in range, of the accounts matching the filters
+
+    Excluding zero topups lets the database read the `balance_topup_idx` partial index, which only holds the balances
+    with a topup, rather than every balance.
+    """
+    balances = models.Balance.objects.exclude(topup=0)
+    if start is not None:
+        balances = balances.filter(timestamp__gte=start)
+    if end is not None:
+        balances = balances.filter(timestamp__lte=end)
+    if filters:
+        balances = balances.filter(account__in=models.Account.objects.filtered(filters).values('pk'))
+    return [
+        {
+            "time": epoch_ms(timestamp),
+            "title": "Topup" if topup > 0 else "Withdrawal",
+            "text": f"{bank_name} - {account_name}: {settings.CURRENCY_FORMAT.format(abs(topup))}",
+            "tags": ["topup" if topup > 0 else "withdrawal", bank_name],
+        }
+        for timestamp, topup, bank_name, account_name in balances.order_by('timestamp').values_list(
+            'timestamp', 'topup', 'account__bank_name', 'account__account_name'
+        )
+    ]
+
+
+def within(balance: Decimal, interest_min: Optional[Decimal], interest_max: Optional[Decimal]) -> bool:
+    return (interest_min is None or balance >= interest_min) and (interest_max is None or balance <= interest_max)
+
+
+def limit_crossings(start: Optional[datetime.date], end: Optional[datetime.date],
+                    filters: Sequence[models.AccountFilter] = ()) -> List[dict]:
+    """An event for every check in range that moved a balance outside its interest limits, or back within them
+
+    Only the balances of accounts with limits are read, through the account and timestamp index.
+    """
+    accounts = models.Account.objects.filtered(filters).filter(
+        db.Q(interest_min__isnull=False) | db.Q(interest_max__isnull=False)
+    )
+    limits = {
+        pk: (bank_name, account_name, interest_min, interest_max)
+        for pk, bank_name, account_name, interest_min, interest_max in accounts.values_list(
+            'pk', 'bank_name', 'account_name', 'interest_min', 'interest_max'
+        )
+    }
+    if not limits:
+        return []
+    balances = models.Balance.objects.filter(account__in=list(limits)).between(start, end).with_history()
+    events = []
+    for account_id, timestamp, balance, previous in balances.order_by('timestamp', 'account').values_list(
+        'account', 'timestamp', 'balance', 'previous_balance'
+    ):
+        bank_name, account_name, interest_min, interest_max = limits[account_id]
+        if (start is not None and timestamp < start) or previous is None or \
+                within(balance, interest_min, interest_max) == within(previous, interest_min, interest_max):
+            continue
+        if within(balance, interest_min, interest_max):
+            title, tag = "Balance back within interest limits", "within-limits"
+        elif interest_max is not None and balance > interest_max:
+            title, tag = "Balance above interest maximum", "above-limit"
+        else:
+            title, tag = "Balance below interest minimum", "below-limit"
+        events.append({
+            "time": epoch_ms(timestamp),
+            "title": title,
+            "text": f"{bank_name} - {account_name}: {settings.CURRENCY_FORMAT.format(balance)}",
+            "tags": [tag, bank_name],
+        })
+    return events
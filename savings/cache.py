@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from typing import Callable, Dict, Hashable, Iterable, Tuple
+
+from django.core.cache import caches
+
+from . import metrics, models
+
+CACHE_ALIAS = 'grafana'
+
+
+class QueryCache:
+    """Serialized /query responses, keyed by the request and the data version of every account
+
+    Data versions are stored with the accounts, so a write from any process, such as another worker or a management
+    command, is seen by every process with a single query. Versions are random tokens rather than counters, so an
+    account recreated with the same primary key can never match a response stored for the old one. With the default
+    in-process LocMemCache the cache is LRU-bounded by `MAX_ENTRIES`.
+    """
+
+    def __init__(self, alias: str = CACHE_ALIAS):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def account_versions() -> Dict[int, str]:
+        """Current data version of every account"""
+        return dict(models.Account.objects.order_by('pk').values_list('pk', 'data_version'))
+
+    def versions(self) -> Tuple:
+        return tuple(self.account_versions().items())
+
+    def fingerprint(self, request_key: Hashable) -> str:
+        """Identifies the response to a request with the current data, reading the data versions in one query"""
+        return hashlib.sha1(repr((request_key, self.versions())).encode()).hexdigest()
+
+    def get_or_set(self, fingerprint: str, render: Callable[[], bytes]) -> Tuple[bytes, bool]:
+        """Cached response with this fingerprint, rendering and storing it on a miss, and whether it was a hit"""
+        key = f'savings:query:{fingerprint}'
+        content = self.cache.get(key)
+        hit = content is not None
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.cache_lookups.inc("hit" if hit else "miss")
+        if not hit:
+            content = render()
+            self.cache.set(key, content, None)
+        return content, hit
+
+    def bump(self, account_ids: Iterable[int]):
+        """Invalidate responses built from the data of these accounts"""
+        models.Account.objects.filter(pk__in=list(account_ids)).update(data_version=models.new_version())
+
+    def bump_all(self):
+        """Invalidate every response, e.g. after balances are written in bulk"""
+        models.Account.objects.update(data_version=models.new_version())
+
+    def clear(self):
+        """Drop every cached response, so the next requests are rendered whatever the data, as when benchmarking"""
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else None,
+        }
+
+
+query_cache = QueryCache()
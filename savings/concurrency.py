@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+T = TypeVar('T')
+
+_pools: Dict[int, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def executor() -> Optional[ThreadPoolExecutor]:
+    """Pool of `QUERY_WORKERS` threads shared by every request, or None when targets should be evaluated in turn
+
+    Each thread uses its own database connection, so an in-memory SQLite database, which is private to the connection
+    that opened it, is always queried from the request thread.
+    """
+    workers = settings.QUERY_WORKERS
+    if workers <= 1 or any(connection.vendor == 'sqlite' and connection.is_in_memory_db()
+                           for connection in connections.all()):
+        return None
+    with _lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='savings-query')
+        return _pools[workers]
+
+
+def _in_worker(task: Callable[[], T]) -> T:
+    try:
+        return task()
+    finally:
+        # Worker threads outlive requests, so the request_finished cleanup never reaches their connections
+        close_old_connections()
+
+
+def run_concurrently(tasks: List[Callable[[], T]]) -> List[T]:
+    """Results of independent tasks, run on the shared pool while the calling thread runs the first one
+
+    The pool is bounded, so under load tasks queue up instead of opening a database connection each. Tasks run in a
+    copy of the caller's context, so that their queries count towards the request's metrics.
+    """
+    pool = executor()
+    if pool is None or len(tasks) < 2:
+        return [task() for task in tasks]
+    futures = [pool.submit(contextvars.copy_context().run, _in_worker, task) for task in tasks[1:]]
+    first = tasks[0]()
+    return [first] + [future.result() for future in futures]
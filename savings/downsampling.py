@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+Datapoint = List[Optional[float]]
+
+
+def lttb(datapoints: Sequence[Datapoint], threshold: int) -> List[Datapoint]:
+    """Reduce a Grafana series to at most `threshold` points using Largest-Triangle-Three-Buckets
+
+    Datapoints are `[value, timestamp]` pairs sorted by timestamp. The first and last points are always kept, and
+    for every bucket in between the point forming the largest triangle with its neighbours is chosen, so peaks and
+    troughs survive the reduction. Points without a value can't be ranked and are dropped when downsampling.
+    """
+    if threshold <= 0 or len(datapoints) <= threshold:
+        return list(datapoints)
+
+    points = [point for point in datapoints if point[0] is not None]
+    if len(points) <= threshold:
+        return points
+    if threshold < 3:
+        return [points[0], points[-1]][:threshold]
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    selected = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average of the following bucket is the third vertex of the triangle
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[end:next_end] or points[-1:]
+        avg_value = sum(point[0] for point in next_bucket) / len(next_bucket)
+        avg_time = sum(point[1] for point in next_bucket) / len(next_bucket)
+
+        selected_value, selected_time = points[selected]
+        best_area = -1.0
+        best = start
+        for index in range(start, end):
+            value, time = points[index]
+            area = abs((selected_time - avg_time) * (value - selected_value) -
+                       (selected_time - time) * (avg_value - selected_value))
+            if area > best_area:
+                best_area = area
+                best = index
+
+        sampled.append(points[best])
+        selected = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def minmax_buckets(datapoints: Iterable[Datapoint], start: int, end: int, threshold: int) -> Iterator[Datapoint]:
+    """Reduce a streamed Grafana series to at most `threshold` points, keeping the extremes of each time bucket
+
+    The span from `start` to `end` (epoch milliseconds) is split into `threshold // 2` buckets and the lowest and
+    highest point of each is kept, in time order. Unlike `lttb` this needs neither the number of points nor any
+    look-ahead, so it runs in constant memory. Points without a value are dropped.
+    """
+    buckets = max(threshold // 2, 1)
+    span = max(end - start, 1)
+    current = None
+    low = high = None
+    for point in datapoints:
+        value, time = point
+        if value is None:
+            continue
+        bucket = min(max((time - start) * buckets // span, 0), buckets - 1)
+        if bucket != current:
+            if current is not None:
+                yield from _in_time_order(low, high)
+            current = bucket
+            low = high = point
+        elif value < low[0]:
+            low = point
+        elif value > high[0]:
+            high = point
+    if current is not None:
+        yield from _in_time_order(low, high)
+
+
+def _in_time_order(low: Datapoint, high: Datapoint) -> List[Datapoint]:
+    if low is high:
+        return [low]
+    return [low, high] if low[1] <= high[1] else [high, low]
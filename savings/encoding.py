@@ -0,0 +1,15 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value) -> bytes:
+    """Encode a response as JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value, default=DjangoJSONEncoder().default)
+    return json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import bisect
+import csv
+import datetime
+import re
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import models
+
+
+class Record(NamedTuple):
+    """A balance read from a statement"""
+    account_id: int
+    timestamp: datetime.date
+    balance: Decimal
+    topup: Decimal = Decimal(0)
+
+
+class StatementError(ValueError):
+    """Raised for statements that can't be read"""
+
+
+def read_csv(file: TextIO, account_id: Optional[int] = None) -> Iterator[Record]:
+    """Stream records from a CSV file with `timestamp`, `balance` and optional `account` and `topup` columns
+
+    `account` holds the primary key of the account, and may be left out when `account_id` is given.
+    """
+    for line, row in enumerate(csv.DictReader(file), start=2):
+        try:
+            yield Record(
+                account_id=int(row["account"]) if row.get("account") else account_id,
+                timestamp=datetime.date.fromisoformat(row["timestamp"].strip()),
+                balance=Decimal(row["balance"]),
+                topup=Decimal(row.get("topup") or 0),
+            )
+        except (KeyError, TypeError, ValueError, ArithmeticError) as error:
+            raise StatementError(f"line {line}: {error!r}") from error
+
+
+OFX_TAG = re.compile(r'<(/?)([A-Z0-9.]+)>([^<\r\n]*)')
+
+
+def read_ofx(file: TextIO, account_id: Optional[int] = None) -> Iterator[Record]:
+    """Stream the ledger balance of every statement in an OFX file, SGML (1.x) or XML (2.x)
+
+    Statements are matched to accounts by their `ACCTID` and the account number, unless `account_id` is given.
+    """
+    accounts = dict(models.Account.objects.exclude(account_number='').values_list('account_number', 'pk'))
+    account_number = amount = as_of = None
+    in_ledger = False
+    for line in file:
+        for closing, tag, value in OFX_TAG.findall(line):
+            value = value.strip()
+            if tag == 'ACCTID' and not closing:
+                account_number = value
+            elif tag == 'LEDGERBAL':
+                in_ledger = not closing
+            elif in_ledger and tag == 'BALAMT' and not closing:
+                amount = value
+            elif in_ledger and tag == 'DTASOF' and not closing:
+                as_of = value
+            elif tag in ('STMTRS', 'CCSTMTRS') and closing:
+                if amount is None or as_of is None:
+                    raise StatementError(f"statement for {account_number} has no ledger balance")
+                if account_id is None and account_number not in accounts:
+                    raise StatementError(f"no account with number {account_number}")
+                yield Record(
+                    account_id=account_id or accounts[account_number],
+                    timestamp=datetime.datetime.strptime(as_of[:8], '%Y%m%d').date(),
+                    balance=Decimal(amount),
+                )
+                account_number = amount = as_of = None
+
+
+class AccountHistory:
+    """The balances of one account, stored or already imported, used to find the previous check of each record"""
+
+    def __init__(self, account_id: int):
+        stored = models.Balance.objects.filter(account_id=account_id).order_by('timestamp')
+        self.timestamps: List[datetime.date] = []
+        self.balances: List[Decimal] = []
+        for timestamp, balance in stored.values_list('timestamp', 'balance'):
+            self.timestamps.append(timestamp)
+            self.balances.append(balance)
+        self.stale_since: Optional[datetime.date] = None
+
+    def __contains__(self, timestamp: datetime.date) -> bool:
+        """Whether the account already has a stored or imported check on this date"""
+        index = bisect.bisect_left(self.timestamps, timestamp)
+        return index < len(self.timestamps) and self.timestamps[index] == timestamp
+
+    def previous(self, timestamp: datetime.date) -> Optional[models.Balance]:
+        """Latest stored or already imported check before `timestamp`"""
+        index = bisect.bisect_left(self.timestamps, timestamp)
+        return models.Balance(timestamp=self.timestamps[index - 1], balance=self.balances[index - 1]) if index else None
+
+    def add(self, timestamp: datetime.date, balance: Decimal):
+        """Record an imported check, appending it when records arrive in order"""
+        index = bisect.bisect_left(self.timestamps, timestamp)
+        self.timestamps.insert(index, timestamp)
+        self.balances.insert(index, balance)
+
+    def has_checks_after(self, timestamp: datetime.date) -> bool:
+        return bool(self.timestamps) and self.timestamps[-1] > timestamp
+
+    def mark_stale(self, timestamp: datetime.date):
+        """Records from `timestamp` on need their derived fields rebuilt once the import is stored"""
+        self.stale_since = min(self.stale_since or timestamp, timestamp)
+
+
+class BalanceImporter:
+    """Writes streamed records with `bulk_create`, computing their derived fields in the same pass
+
+    Records are expected in timestamp order for each account, as exported by banks. Records that arrive out of order,
+    or that land between stored checks, are still imported and the affected part of their account is rebuilt with a
+    single `BalanceQuerySet.recompute` once everything has been written. Records for a date the account already has a
+    balance for are skipped.
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.histories: Dict[int, AccountHistory] = {}
+        self.pending: List[models.Balance] = []
+        self.created = 0
+        self.skipped = 0
+
+    def add(self, record: Record):
+        history = self.histories.get(record.account_id)
+        if history is None:
+            if not models.Account.objects.filter(pk=record.account_id).exists():
+                raise StatementError(f"no account with id {record.account_id}")
+            history = self.histories[record.account_id] = AccountHistory(record.account_id)
+
+        if record.timestamp in history:
+            self.skipped += 1
+            return
+        if history.has_checks_after(record.timestamp):
+            history.mark_stale(record.timestamp)
+
+        balance = models.Balance(account_id=record.account_id, timestamp=record.timestamp,
+                                 balance=record.balance, topup=record.topup)
+        previous = history.previous(record.timestamp)
+        balance.days_since_last_check = balance.days_after(previous)
+        balance.APR = balance.APR_after(previous)
+        history.add(record.timestamp, record.balance)
+
+        self.pending.append(balance)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        models.Balance.objects.bulk_create(self.pending)
+        self.created += len(self.pending)
+        self.pending = []
+
+    def run(self, records: Iterable[Record]) -> BalanceImporter:
+        """Import every record in a single transaction"""
+        with transaction.atomic():
+            for record in records:
+                self.add(record)
+            self.flush()
+            for account_id, history in self.histories.items():
+                if history.stale_since is not None:
+                    models.Balance.objects.filter(account_id=account_id).recompute(since=history.stale_since)
+        models.balances_changed.send(sender=models.Balance)
+        return self
+
+
+def validate(item, accounts: Set[int]) -> Tuple[Optional[Record], Dict[str, List[str]]]:
+    """Record for a `{account, timestamp, balance, topup}` item, or the errors that prevent creating one"""
+    if not isinstance(item, dict):
+        return None, {"__all__": ["Expected an object"]}
+    errors = {}
+    values = {}
+    try:
+        values["account_id"] = int(item.get("account"))
+        if values["account_id"] not in accounts:
+            errors["account"] = [f"No account with id {values['account_id']}"]
+    except (TypeError, ValueError):
+        errors["account"] = ["Expected an account id"]
+    for name in ('timestamp', 'balance', 'topup'):
+        field = models.Balance._meta.get_field(name)
+        try:
+            values[name] = field.clean(item.get(name, field.get_default()), None)
+        except ValidationError as error:
+            errors[name] = error.messages
+    return (None if errors else Record(**values)), errors
+
+
+def upsert(items: List[dict]) -> List[dict]:
+    """Create or update balances from `{account, timestamp, balance, topup}` items, in a single transaction
+
+    Every item is validated before anything is written, invalid items are reported and left out. Only the written
+    balances and the balance following each of them have their derived fields rebuilt. Returns one status per item.
+    """
+    accounts = set(models.Account.objects.values_list('pk', flat=True))
+    statuses: List[dict] = []
+    records: Dict[Tuple[int, datetime.date], Record] = {}
+    for item in items:
+        record, errors = validate(item, accounts)
+        if record is not None and (record.account_id, record.timestamp) in records:
+            errors = {"timestamp": ["Account already has a balance on this date earlier in the batch"]}
+        if errors:
+            statuses.append({"status": "invalid", "errors": errors})
+        else:
+            records[(record.account_id, record.timestamp)] = record
+            statuses.append({"status": None})
+    if not records:
+        return statuses
+
+    account_ids = {account_id for account_id, _ in records}
+    with transaction.atomic():
+        touched = models.Balance.objects.filter(
+            account_id__in=account_ids, timestamp__in={timestamp for _, timestamp in records}
+        )
+        stored = {
+            (balance.account_id, balance.timestamp): balance
+            for balance in touched if (balance.account_id, balance.timestamp) in records
+        }
+        changed = {}
+        for key, balance in stored.items():
+            record = records[key]
+            if (balance.balance, balance.topup) != (record.balance, record.topup):
+                balance.balance, balance.topup = record.balance, record.topup
+                changed[key] = balance
+        models.Balance.objects.bulk_update(changed.values(), ['balance', 'topup'], batch_size=500)
+        models.Balance.objects.bulk_create([
+            models.Balance(account_id=record.account_id, timestamp=record.timestamp,
+                           balance=record.balance, topup=record.topup)
+            for key, record in records.items() if key not in stored
+        ], batch_size=500)
+
+        pks = {
+            (account_id, timestamp): pk
+            for pk, account_id, timestamp in touched.values_list('pk', 'account', 'timestamp')
+            if (account_id, timestamp) in records
+        }
+        written = {pk for key, pk in pks.items() if key not in stored or key in changed}
+        if written:
+            models.Balance.objects.filter(account_id__in=account_ids).refresh(
+                written, since=min(timestamp for _, timestamp in records)
+            )
+    models.balances_changed.send(sender=models.Balance, account_ids=account_ids)
+
+    keys = iter(records)
+    for status in statuses:
+        if status["status"] is None:
+            key = next(keys)
+            status["id"] = pks[key]
+            status["status"] = "created" if key not in stored else "updated" if key in changed else "unchanged"
+    return statuses
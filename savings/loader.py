@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import datetime
+import functools
+import itertools
+import operator
+from collections import defaultdict
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from django.utils.functional import cached_property
+
+from . import models
+from .downsampling import lttb, minmax_buckets
+
+if TYPE_CHECKING:
+    from .store import SeriesStore
+
+# Values kept for every balance in a snapshot, after its Grafana timestamp
+SERIES_FIELDS = ('balance', 'APR', 'returns')
+# Annotations of `BalanceQuerySet.with_history` holding each series field
+HISTORY_FIELDS = {'balance': 'balance', 'APR': 'period_APR', 'returns': 'period_returns'}
+
+
+def number(value) -> Optional[float]:
+    """Grafana representation of a possibly missing decimal"""
+    return float(value) if value is not None else None
+
+
+@functools.lru_cache(maxsize=65536)
+def epoch_ms(date: datetime.date) -> int:
+    """Grafana timestamp for midnight at the start of a date"""
+    return int(datetime.datetime.combine(date, datetime.datetime.min.time()).timestamp()*1000)
+
+
+class QueryLoader:
+    """Accounts and balances needed by a single Grafana query, fetched at most once and shared by every target"""
+
+    def __init__(self, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                 store: Optional[SeriesStore] = None, filters: Sequence[models.AccountFilter] = ()):
+        self.start = start
+        self.end = end
+        self.store = store
+        self.filters = filters
+        self._buckets = {}
+
+    def balance_set(self) -> models.BalanceQuerySet:
+        """Balances of the accounts matching the filters"""
+        balances = models.Balance.objects.all()
+        if self.filters:
+            balances = balances.filter(account__in=models.Account.objects.filtered(self.filters).values('pk'))
+        return balances
+
+    def prefetch(self, buckets: Set[Optional[str]]) -> List[Callable]:
+        """Independent queries needed by series with these buckets, to run concurrently before calling `series`"""
+        tasks = []
+        if buckets - {None} or (None in buckets and (self.store is None or self.filters)):
+            tasks.append(lambda: self.accounts)
+        if None in buckets:
+            tasks.append(self.store.refresh if self.store is not None else lambda: self.balances)
+        tasks += [functools.partial(self.buckets, kind) for kind in buckets - {None}]
+        return tasks
+
+    @cached_property
+    def accounts(self) -> List[models.Account]:
+        """Every account matching the filters, in the order series are returned"""
+        return list(models.Account.objects.filtered(self.filters).only('bank_name', 'account_name').order_by('pk'))
+
+    @cached_property
+    def balances(self) -> Dict[int, List[Tuple[int, Optional[float], Optional[float], Optional[float]]]]:
+        """`(timestamp, balance, APR, returns)` rows in range for each account, ordered by timestamp"""
+        rows = defaultdict(list)
+        balances = self.balance_set().between(self.start, self.end).with_history().order_by('account', 'timestamp')
+        for account_id, timestamp, balance, APR, returns in balances.values_list(
+            'account', 'timestamp', 'balance', 'period_APR', 'period_returns'
+        ):
+            if self.start is None or timestamp >= self.start:
+                rows[account_id].append((epoch_ms(timestamp), number(balance), number(APR), number(returns)))
+        return rows
+
+    def buckets(self, kind: str) -> Dict[int, List[Tuple[int, Optional[float], Optional[float], Optional[float]]]]:
+        """Like `balances`, but with one row per day, week or month aggregated by the database"""
+        if kind not in self._buckets:
+            rows = defaultdict(list)
+            for account_id, bucket, balance, APR, returns in self.balance_set().buckets(kind, self.start, self.end):
+                rows[account_id].append((epoch_ms(bucket), number(balance), number(APR), number(returns)))
+            self._buckets[kind] = rows
+        return self._buckets[kind]
+
+    def series(self, field: str, limit: Optional[int] = None, bucket: Optional[str] = None) -> list:
+        """One Grafana series of `field` per account, aggregated by `bucket` and downsampled to at most `limit` points"""
+        if bucket is None and self.store is not None:
+            account_ids = {account.pk for account in self.accounts} if self.filters else None
+            return self.store.series(field, self.start, self.end, limit, account_ids)
+        column = SERIES_FIELDS.index(field) + 1
+        rows = self.buckets(bucket) if bucket else self.balances
+        response = []
+        for account in self.accounts:
+            datapoints = [[row[column], row[0]] for row in rows.get(account.pk, ())]
+            response.append({
+                "target": str(account),
+                "datapoints": lttb(datapoints, limit) if limit else datapoints,
+            })
+        return response
+
+    def iter_series(self, field: str, limit: Optional[int] = None) -> Iterator[Tuple[models.Account, Iterator[list]]]:
+        """Like `series`, but streaming the datapoints of each account from a database cursor
+
+        Instead of sharing the snapshot every call runs its own query, holding no more than one chunk of rows in
+        memory. The datapoints of an account must be consumed before moving on to the next account. When the range is
+        bounded, series are downsampled with `minmax_buckets`, which needs no look-ahead.
+        """
+        balances = self.balance_set().between(self.start, self.end)
+        if field != 'balance':
+            balances = balances.with_history()
+        rows = balances.order_by('account', 'timestamp').values_list(
+            'account', 'timestamp', HISTORY_FIELDS[field]
+        ).iterator(chunk_size=2000)
+        groups = itertools.groupby(rows, key=operator.itemgetter(0))
+        group = next(groups, None)
+        for account in self.accounts:
+            while group is not None and group[0] < account.pk:
+                group = next(groups, None)
+            if group is not None and group[0] == account.pk:
+                rows = group[1]
+                group = None
+            else:
+                rows = iter(())
+            datapoints = (
+                [number(value), epoch_ms(timestamp)]
+                for _, timestamp, value in rows if self.start is None or timestamp >= self.start
+            )
+            if limit and self.start and self.end:
+                datapoints = minmax_buckets(datapoints, epoch_ms(self.start),
+                                            epoch_ms(self.end + datetime.timedelta(days=1)), limit)
+            elif limit:
+                datapoints = iter(lttb(list(datapoints), limit))
+            yield account, datapoints
+            if group is None:
+                group = next(groups, None)
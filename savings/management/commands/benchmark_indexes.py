@@ -0,0 +1,96 @@
+import datetime
+import random
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from savings import models
+
+BEFORE = '0010_balance_days_since_last_check'
+AFTER = '0011_balance_indexes'
+
+
+def hot_queries(database: str, accounts: int, days: int) -> dict:
+    """The Balance queries that filter by account and order by timestamp, as used by the models and views"""
+    balances = models.Balance.objects.using(database)
+    account_id = accounts // 2
+    middle = datetime.date(2010, 1, 1) + datetime.timedelta(days=days // 2)
+    return {
+        "previous_check": balances.filter(account_id=account_id, timestamp__lt=middle).order_by('timestamp').reverse()[:1],
+        "current_balance": balances.filter(account_id=account_id).order_by('-timestamp')[:1],
+        "range_series": balances.filter(
+            account_id=account_id, timestamp__range=(middle, middle + datetime.timedelta(days=90))
+        ).order_by('timestamp'),
+        "topups": balances.filter(account_id=account_id).exclude(topup=0).order_by('timestamp'),
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare query plans and latencies of the hot Balance queries before and after the 0011 indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=1000, help="Daily balances per account")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed runs of each query")
+        parser.add_argument('--database', default='benchmark',
+                            help="Database alias to fill with synthetic data, an in-memory SQLite database by default")
+
+    def handle(self, *args, accounts=1000, days=1000, repeat=50, database='benchmark', **options):
+        if database not in connections.databases:
+            connections.databases[database] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+            connections.ensure_defaults(database)
+            connections.prepare_test_settings(database)
+
+        call_command('migrate', 'savings', BEFORE, database=database, verbosity=0)
+        self.populate(database, accounts, days)
+        self.report("Before (FK index only)", database, accounts, days, repeat)
+
+        started = time.perf_counter()
+        call_command('migrate', 'savings', AFTER, database=database, verbosity=0)
+        self.stdout.write(f"\nBuilt indexes in {time.perf_counter() - started:.1f}s")
+        self.report(f"After {AFTER}", database, accounts, days, repeat)
+
+    def populate(self, database: str, accounts: int, days: int):
+        """Insert `accounts * days` synthetic balances, bypassing the ORM for speed
+
+        Rows are inserted with SQL, as the current models have columns added by migrations after `BEFORE`.
+        """
+        rnd = random.Random(0)
+        start = datetime.date(2010, 1, 1)
+        table = models.Balance._meta.db_table
+        connection = connections[database]
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {models.Account._meta.db_table} (id, bank_name, account_name, account_number, sort_code, '
+                f'predicted_interest, instant_withdrawal) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                [
+                    (pk, f"Bank {pk % 20}", f"Account {pk}", '', '', '0.01', bool(pk % 2))
+                    for pk in range(1, accounts + 1)
+                ],
+            )
+            for day in range(days):
+                timestamp = str(start + datetime.timedelta(days=day))
+                cursor.executemany(
+                    f'INSERT INTO {table} (account_id, timestamp, balance, topup, days_since_last_check, "APR") '
+                    f'VALUES (%s, %s, %s, %s, %s, %s)',
+                    [
+                        (pk, timestamp, 1000 + day, 100 if rnd.random() < 0.02 else 0, 1 if day else None, 0.01)
+                        for pk in range(1, accounts + 1)
+                    ],
+                )
+        self.stdout.write(f"Inserted {accounts * days} balances in {time.perf_counter() - started:.1f}s")
+
+    def report(self, title: str, database: str, accounts: int, days: int, repeat: int):
+        self.stdout.write(f"\n{title}\n{'=' * len(title)}")
+        for name, queryset in hot_queries(database, accounts, days).items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"\n{name}: median {statistics.median(timings):.3f}ms, max {max(timings):.3f}ms")
+            self.stdout.write(queryset.explain())
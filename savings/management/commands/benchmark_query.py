@@ -0,0 +1,106 @@
+import asyncio
+import datetime
+import json
+import logging
+import statistics
+import time
+from typing import Callable, List
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from savings import models
+from savings.cache import query_cache
+
+
+def dashboard(panels: int, days: int) -> dict:
+    """A Grafana query as sent by a dashboard with an accounts table and `panels` series panels"""
+    end = models.Balance.objects.order_by('-timestamp').values_list('timestamp', flat=True).first()
+    start = end - datetime.timedelta(days=days)
+    return {
+        "range": {"from": f"{start}T00:00:00Z", "to": f"{end}T23:59:59Z"},
+        "maxDataPoints": 1000,
+        "targets": [{"target": "accounts"}] + [
+            {"target": target} for target in ["balances", "APRs", "returns"][:panels]
+        ],
+    }
+
+
+def wsgi_query(body: bytes) -> Callable[[], int]:
+    client = Client(HTTP_HOST='localhost')
+
+    def post() -> int:
+        return client.post('/query', body, content_type='application/json').status_code
+    return post
+
+
+def asgi_query(body: bytes) -> Callable[[], int]:
+    application = get_asgi_application()
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+        'path': '/query', 'raw_path': b'/query', 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json')],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+
+    async def call() -> int:
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(dict(scope), receive, send)
+        return status[0]
+
+    def post() -> int:
+        return asyncio.run(call())
+    return post
+
+
+class Command(BaseCommand):
+    help = "Time uncached /query requests through the WSGI and ASGI handlers, with targets evaluated in turn and " \
+           "concurrently"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help="Range of the dashboard, ending at the last balance")
+        parser.add_argument('--panels', type=int, default=3, choices=[1, 2, 3], help="Series targets in the query")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed requests for each configuration")
+        parser.add_argument('--workers', type=int, default=4, help="QUERY_WORKERS for the concurrent runs")
+
+    def handle(self, *args, days=365, panels=3, repeat=20, workers=4, **options):
+        if not models.Balance.objects.exists():
+            raise CommandError("The database has no balances to query")
+        body = json.dumps(dashboard(panels, days)).encode()
+
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            for handler, make_query in (("WSGI", wsgi_query), ("ASGI", asgi_query)):
+                post = make_query(body)
+                # Request logging would dominate the timings and flood the output, set up after the ASGI application
+                # resets it
+                logging.getLogger('django.request').setLevel(logging.WARNING)
+                for label, query_workers in (("in turn", 1), (f"{workers} workers", workers)):
+                    with override_settings(QUERY_WORKERS=query_workers):
+                        timings = self.time(post, repeat)
+                    self.stdout.write(
+                        f"{handler}, {label}: median {statistics.median(timings):.1f}ms, "
+                        f"min {min(timings):.1f}ms, max {max(timings):.1f}ms"
+                    )
+
+    def time(self, post: Callable[[], int], repeat: int) -> List[float]:
+        timings = []
+        for _ in range(repeat + 1):
+            # Every request has to be rendered, not served from the response cache
+            query_cache.clear()
+            started = time.perf_counter()
+            status = post()
+            timings.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                raise CommandError(f"/query answered {status}")
+        # The first request warms up connections and the thread pool
+        return timings[1:]
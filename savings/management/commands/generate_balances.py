@@ -0,0 +1,33 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from savings import models
+from savings.synthetic import START, clear, generate
+
+
+class Command(BaseCommand):
+    help = "Create reproducible synthetic accounts and balances, to benchmark the Grafana API at scale"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=10)
+        parser.add_argument('--years', type=int, default=1, help="Years of checks for each account")
+        parser.add_argument('--every', type=int, default=1, help="Days between checks")
+        parser.add_argument('--seed', type=int, default=0, help="The same seed and scale always give the same data")
+        parser.add_argument('--start', type=datetime.date.fromisoformat, default=START, help="Date of the first checks")
+        parser.add_argument('--replace', action='store_true', help="Delete every account and balance first")
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, accounts=10, years=1, every=1, seed=0, start=START, replace=False, database='default',
+               **options):
+        if accounts < 1 or years < 1 or every < 1:
+            raise CommandError("--accounts, --years and --every must be positive")
+        if replace:
+            clear(database)
+        elif models.Account.objects.using(database).exists():
+            raise CommandError("The database already has accounts, use --replace to delete them first")
+
+        started = time.perf_counter()
+        created = generate(accounts, years * 365, every, seed, start, database)
+        self.stdout.write(f"Created {accounts} accounts and {created} balances in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from savings.importers import BalanceImporter, StatementError, read_csv, read_ofx
+
+READERS = {
+    'csv': read_csv,
+    'ofx': read_ofx,
+}
+
+
+class Command(BaseCommand):
+    help = "Import balances from CSV or OFX statements, skipping dates that already have a balance"
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help="Statement files, or - to read from stdin")
+        parser.add_argument('--format', choices=READERS, help="Statement format (default: from the file extension)")
+        parser.add_argument('--account', type=int,
+                            help="Account the balances belong to, for files that don't identify it")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Balances written per INSERT")
+
+    def handle(self, *args, files=(), format=None, account=None, batch_size=1000, **options):
+        importer = BalanceImporter(batch_size=batch_size)
+        started = time.perf_counter()
+        for path in files:
+            reader = READERS.get(format or os.path.splitext(path)[1].lstrip('.').lower() or 'csv')
+            if reader is None:
+                raise CommandError(f"{path}: unknown statement format, use --format")
+            file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+            try:
+                importer.run(reader(file, account_id=account))
+            except StatementError as error:
+                raise CommandError(f"{path}: {error}")
+            finally:
+                if file is not sys.stdin:
+                    file.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.created} balances, skipped {importer.skipped} already recorded "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,159 @@
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+
+from savings import models
+from savings.cache import query_cache
+from savings.management.commands.benchmark_query import asgi_query, dashboard, wsgi_query
+
+Result = Tuple[float, Optional[int]]
+
+
+def generated_payloads(count: int, seed: int) -> List[dict]:
+    """`count` Grafana queries as sent by a mix of dashboards, ranges and panels"""
+    rnd = random.Random(seed)
+    payloads = []
+    for _ in range(count):
+        payload = dashboard(rnd.randint(1, 3), rnd.choice([7, 30, 90, 365, 3650]))
+        if rnd.random() < 0.3:
+            payload["targets"].append({"target": "portfolio", "data": {"group_by": "bank_name"}})
+        if rnd.random() < 0.2:
+            payload["targets"].append({"target": "balances", "data": {"bucket": "month"}})
+        payloads.append(payload)
+    return payloads
+
+
+def recorded_payloads(path: str) -> List[dict]:
+    """Queries saved as a JSON array, or one per line"""
+    with open(path) as file:
+        text = file.read()
+    try:
+        payloads = json.loads(text)
+    except ValueError:
+        payloads = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(payloads, dict):
+        payloads = [payloads]
+    return payloads
+
+
+def http_query(url: str) -> Callable[[bytes], Callable[[], int]]:
+    """Poster sending a body to /query on a running server"""
+    def make(body: bytes) -> Callable[[], int]:
+        def post() -> int:
+            request = urllib.request.Request(f"{url.rstrip('/')}/query", data=body,
+                                             headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as error:
+                return error.code
+        return post
+    return make
+
+
+def percentile(timings: List[float], percent: int) -> float:
+    return statistics.quantiles(timings, n=100, method='inclusive')[percent - 1] if len(timings) > 1 else timings[0]
+
+
+class Command(BaseCommand):
+    help = "Replay recorded or generated Grafana queries against /query from concurrent clients, reporting " \
+           "throughput, latency percentiles and errors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handler', choices=['wsgi', 'asgi'], default='wsgi',
+                            help="Application to call in process, unless --url is given")
+        parser.add_argument('--url', help="Base URL of a running server to send queries to instead")
+        parser.add_argument('--payloads', help="JSON file of recorded queries, an array or one per line")
+        parser.add_argument('--generate', type=int, default=50, help="Queries to generate without --payloads")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--concurrency', type=int, default=8, help="Clients sending queries at the same time")
+        parser.add_argument('--requests', type=int, default=200, help="Queries to send in total")
+        parser.add_argument('--warmup', type=int, default=0, help="Untimed queries sent first")
+        parser.add_argument('--cold', action='store_true', help="Bypass the response cache for every query")
+
+    def handle(self, *args, handler='wsgi', url=None, payloads=None, generate=50, seed=0, concurrency=8, requests=200,
+               warmup=0, cold=False, **options):
+        if concurrency < 1 or requests < 1:
+            raise CommandError("--concurrency and --requests must be positive")
+        if payloads:
+            queries = recorded_payloads(payloads)
+        elif models.Balance.objects.exists():
+            queries = generated_payloads(generate, seed)
+        else:
+            raise CommandError("The database has no balances to query, see generate_balances")
+        if not queries:
+            raise CommandError("No queries to replay")
+        bodies = [json.dumps(query).encode() for query in queries]
+
+        make = http_query(url) if url else wsgi_query if handler == 'wsgi' else asgi_query
+        target = url or f"the {handler.upper()} application, {connection.vendor} database"
+        self.stdout.write(f"Replaying {len(bodies)} queries against {target}: {requests} requests from "
+                          f"{concurrency} clients")
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            if warmup:
+                self.run(make, bodies, min(concurrency, warmup), warmup, cold)
+            started = time.perf_counter()
+            results = self.run(make, bodies, concurrency, requests, cold)
+            elapsed = time.perf_counter() - started
+        self.report(results, elapsed)
+
+    def run(self, make: Callable[[bytes], Callable[[], int]], bodies: List[bytes], concurrency: int, requests: int,
+            cold: bool) -> List[Result]:
+        """Latency and status of each request, `None` for requests that failed without a response"""
+        sent = iter(range(requests))
+        lock = threading.Lock()
+        results: List[Result] = []
+        clients = [[make(body) for body in bodies] for _ in range(concurrency)]
+        # Request logging would dominate the timings and flood the output, set up after the ASGI application resets it
+        logging.getLogger('django.request').setLevel(logging.WARNING)
+
+        def client(posts: List[Callable[[], int]]):
+            try:
+                while True:
+                    with lock:
+                        index = next(sent, None)
+                    if index is None:
+                        return
+                    if cold:
+                        query_cache.clear()
+                    started = time.perf_counter()
+                    try:
+                        status = posts[index % len(posts)]()
+                    except Exception as error:
+                        self.stderr.write(f"Request {index} failed: {error!r}")
+                        status = None
+                    elapsed = (time.perf_counter() - started) * 1000
+                    with lock:
+                        results.append((elapsed, status))
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            for future in [pool.submit(client, posts) for posts in clients]:
+                future.result()
+        return results
+
+    def report(self, results: List[Result], elapsed: float):
+        timings = [latency for latency, _ in results]
+        statuses = Counter('error' if status is None else str(status) for _, status in results)
+        failed = sum(count for status, count in statuses.items() if status != '200')
+        self.stdout.write(f"Throughput: {len(results) / elapsed:.1f} requests/s over {elapsed:.1f}s")
+        self.stdout.write(
+            f"Latency: p50 {percentile(timings, 50):.1f}ms, p95 {percentile(timings, 95):.1f}ms, "
+            f"p99 {percentile(timings, 99):.1f}ms, max {max(timings):.1f}ms"
+        )
+        self.stdout.write(f"Errors: {failed / len(results):.1%} "
+                          f"({', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))})")
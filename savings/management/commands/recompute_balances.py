@@ -0,0 +1,63 @@
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections, router
+
+from savings import models
+
+
+def recompute_accounts(account_ids: List[int], since: Optional[datetime.date], database: str) -> Tuple[int, int]:
+    """Recompute the balances of a chunk of accounts, returning the number of accounts and balances updated"""
+    updated = models.Balance.objects.using(database).filter(account_id__in=account_ids).recompute(since)
+    return len(account_ids), updated
+
+
+class Command(BaseCommand):
+    help = "Rebuild days_since_last_check and APR for every balance, e.g. after a bulk import"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help="Only rewrite balances recorded on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help="Account to recompute, may be repeated (default: all accounts)")
+        parser.add_argument('--chunk-size', type=int, default=10,
+                            help="Number of accounts rebuilt by each UPDATE statement")
+        parser.add_argument('--workers', type=int,
+                            help="Number of worker processes (default: one per CPU, or 1 on SQLite)")
+        parser.add_argument('--database', default=router.db_for_write(models.Balance))
+
+    def handle(self, *args, since=None, accounts=None, chunk_size=10, workers=None, database=None, **options):
+        selected = models.Account.objects.using(database).order_by('pk')
+        if accounts:
+            selected = selected.filter(pk__in=accounts)
+        account_ids = list(selected.values_list('pk', flat=True))
+        chunks = [account_ids[i:i + chunk_size] for i in range(0, len(account_ids), chunk_size)]
+        if workers is None:
+            # SQLite serialises writers, extra processes would only wait on the database lock
+            workers = 1 if connections[database].vendor == 'sqlite' else os.cpu_count() or 1
+        workers = max(1, min(workers, len(chunks)))
+
+        done = balances = 0
+        if workers == 1:
+            results = (recompute_accounts(chunk, since, database) for chunk in chunks)
+        else:
+            # Worker processes open their own connections, so don't hand them ours
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+            results = (future.result() for future in as_completed(
+                [pool.submit(recompute_accounts, chunk, since, database) for chunk in chunks]
+            ))
+        try:
+            for accounts_done, updated in results:
+                done += accounts_done
+                balances += updated
+                self.stdout.write(f"Recomputed {done}/{len(account_ids)} accounts ({balances} balances)")
+        finally:
+            if workers > 1:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {balances} balances across {len(account_ids)} accounts"))
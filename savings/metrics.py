@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar('T')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class Metric:
+    """A metric of this process, exposed in the Prometheus text format by `exposition`"""
+    kind = 'untyped'
+    registry: List[Metric] = []
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        Metric.registry.append(self)
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self.values[labels] += amount
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labels, labels)), value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.counts.setdefault(labels, [0] * (len(self.buckets) + 1))
+            counts[index] += 1
+            self.sums[labels] += value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            counts = {labels: list(values) for labels, values in self.counts.items()}
+            sums = dict(self.sums)
+        for labels, values in sorted(counts.items()):
+            named = dict(zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), values):
+                cumulative += count
+                yield f'{self.name}_bucket', {**named, 'le': format_value(bound)}, cumulative
+            yield f'{self.name}_sum', named, sums[labels]
+            yield f'{self.name}_count', named, cumulative
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def exposition() -> str:
+    """Every metric of this process in the Prometheus text format"""
+    lines = []
+    for metric in Metric.registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            rendered = ','.join(f'{key}="{escape(label)}"' for key, label in labels.items())
+            lines.append(f'{name}{{{rendered}}} {format_value(value)}' if rendered else f'{name} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+request_duration = Histogram('savings_request_duration_seconds', "Time to answer a request", ['endpoint', 'method'])
+requests = Counter('savings_requests_total', "Requests answered", ['endpoint', 'method', 'status'])
+request_queries = Histogram('savings_request_sql_queries', "SQL queries run by a request", ['endpoint'],
+                            buckets=QUERY_COUNT_BUCKETS)
+sql_queries = Counter('savings_sql_queries_total', "SQL queries run", ['endpoint'])
+sql_duration = Counter('savings_sql_duration_seconds_total', "Time spent running SQL queries", ['endpoint'])
+response_size = Histogram('savings_response_size_bytes', "Size of response bodies, streamed ones excluded",
+                          ['endpoint'], buckets=SIZE_BUCKETS)
+target_duration = Histogram('savings_target_duration_seconds', "Time to evaluate a Grafana target", ['target'])
+target_queries = Histogram('savings_target_sql_queries', "SQL queries run to evaluate a Grafana target", ['target'],
+                           buckets=QUERY_COUNT_BUCKETS)
+cache_lookups = Counter('savings_response_cache_lookups_total', "Lookups in the response cache", ['result'])
+
+
+class QueryStats:
+    """SQL queries run while measuring a request or a target, including those run by the threads it hands work to
+
+    With `capture`, every statement is kept as `(alias, sql, params, many, seconds)` in `statements`.
+    """
+
+    def __init__(self, capture: bool = False):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Optional[List[Tuple[str, str, Any, bool, float]]] = [] if capture else None
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, alias: str, sql: str, params: Any, many: bool):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            if self.statements is not None:
+                self.statements.append((alias, sql, params, many, seconds))
+
+
+_measuring: contextvars.ContextVar[Tuple[QueryStats, ...]] = contextvars.ContextVar('measuring', default=())
+
+
+@contextlib.contextmanager
+def measuring(capture: bool = False) -> Iterator[QueryStats]:
+    """Count the SQL queries run in this context, nested measurements all count the same query"""
+    stats = QueryStats(capture)
+    token = _measuring.set((*_measuring.get(), stats))
+    try:
+        yield stats
+    finally:
+        _measuring.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the measurements in progress"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for stats in _measuring.get():
+            stats.add(elapsed, context['connection'].alias, sql, params, many)
+
+
+def install(connection):
+    """Wrap a database connection with `record_query`, once"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def measured(target: str, task: Callable[[], T]) -> T:
+    """Result of evaluating part of a Grafana target, recording its latency and SQL queries"""
+    started = time.perf_counter()
+    with measuring() as stats:
+        result = task()
+    target_duration.observe(time.perf_counter() - started, target)
+    target_queries.observe(stats.count, target)
+    return result
@@ -0,0 +1,27 @@
+import time
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """Record the latency, SQL queries and response size of every request, exposed at /metrics"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with metrics.measuring() as stats:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        endpoint = (match.route or '/') if match is not None else 'unmatched'
+        metrics.request_duration.observe(elapsed, endpoint, request.method)
+        metrics.requests.inc(endpoint, request.method, str(response.status_code))
+        metrics.request_queries.observe(stats.count, endpoint)
+        metrics.sql_queries.inc(endpoint, amount=stats.count)
+        metrics.sql_duration.inc(endpoint, amount=stats.seconds)
+        if not response.streaming:
+            metrics.response_size.observe(len(response.content), endpoint)
+        return response
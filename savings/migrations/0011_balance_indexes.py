@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('savings', '0010_balance_days_since_last_check'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='balance',
+            index=models.Index(condition=models.Q(_negated=True, topup=0), fields=['account', 'timestamp'], name='balance_topup_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='balance',
+            constraint=models.UniqueConstraint(fields=('account', 'timestamp'), name='unique_balance_per_day'),
+        ),
+    ]
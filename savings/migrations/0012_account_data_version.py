@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-18 20:36
+
+from django.db import migrations, models
+import savings.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('savings', '0011_balance_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='data_version',
+            field=models.CharField(default=savings.models.new_version, editable=False, max_length=32),
+        ),
+    ]
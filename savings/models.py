@@ -1,11 +1,183 @@
 from __future__ import annotations
 
+import contextlib
+import contextvars
+import datetime
+import re
+import sqlite3
+import uuid
 from decimal import Decimal
-from typing import Optional
+from typing import Collection, FrozenSet, Iterable, Iterator, Optional, Tuple
 
 from computedfields.models import ComputedFieldsModel, computed
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Cast, Lag, LastValue, Least, NullIf, TruncDay, TruncMonth, TruncWeek
+from django.dispatch import Signal
+
+# Sent after balances are written in bulk, bypassing the per-instance save and delete signals, or when those signals
+# don't cover every account affected, with the `account_ids` affected if known
+balances_changed = Signal()
+
+# Accounts being deleted along with their balances, and whether balances are being deleted by a queryset, so the
+# delete signals of each balance can leave its neighbours and data version to the delete as a whole
+_deleted_accounts: contextvars.ContextVar[FrozenSet[int]] = contextvars.ContextVar('deleted_accounts',
+                                                                                    default=frozenset())
+_bulk_delete: contextvars.ContextVar[bool] = contextvars.ContextVar('bulk_delete', default=False)
+
+
+@contextlib.contextmanager
+def _setting(variable: contextvars.ContextVar, value):
+    token = variable.set(value)
+    try:
+        yield
+    finally:
+        variable.reset(token)
+
+
+def deleting_account(account_id: int) -> bool:
+    """Whether the account is being deleted, along with all of its balances"""
+    return account_id in _deleted_accounts.get()
+
+
+def deleting_in_bulk() -> bool:
+    """Whether balances are being deleted by `BalanceQuerySet.delete`, which invalidates their accounts once"""
+    return _bulk_delete.get()
+
+
+class DaysBetween(models.Func):
+    """Whole number of days from the first date expression to the second"""
+    arity = 2
+    output_field = models.IntegerField()
+    template = '(%(end)s - %(start)s)'
+
+    def as_sql(self, compiler, connection, template=None, **extra_context):
+        (start_sql, start_params), (end_sql, end_params) = (
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        )
+        sql = (template or self.template) % {'start': start_sql, 'end': end_sql}
+        return sql, (*end_params, *start_params)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='CAST(julianday(%(end)s) - julianday(%(start)s) AS INTEGER)')
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='DATEDIFF(%(end)s, %(start)s)')
+
+
+class Divide(models.Func):
+    """Division that keeps its fractional part on SQLite, where whole-number decimals are stored as integers"""
+    arity = 2
+    arg_joiner = ' / '
+    template = '(%(expressions)s)'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        dividend, divisor = self.get_source_expressions()
+        clone = self.copy()
+        clone.set_source_expressions([Cast(dividend, models.FloatField()), divisor])
+        return super(Divide, clone).as_sql(compiler, connection, **extra_context)
+
+
+def weighted_APR(prefix: str = '', since: Optional[datetime.date] = None) -> Divide:
+    """Aggregate averaging the APR of balances reached through `prefix`, weighted by the days each one covers
+
+    With `since`, only the days after that date count, so a check covering a period that started earlier is weighted
+    by the part of its period that falls after `since`.
+    """
+    days = models.F(f'{prefix}days_since_last_check')
+    rated = models.Q(**{f'{prefix}APR__isnull': False, f'{prefix}days_since_last_check__isnull': False})
+    if since is not None:
+        days = Least(days, DaysBetween(models.Value(since, output_field=models.DateField()), models.F(f'{prefix}timestamp')))
+        rated &= models.Q(**{f'{prefix}timestamp__gt': since})
+    return Divide(
+        models.Sum(models.ExpressionWrapper(
+            models.F(f'{prefix}APR') * days, output_field=models.DecimalField(decimal_places=4, max_digits=10)
+        ), filter=rated),
+        NullIf(models.Sum(days, filter=rated), 0),
+        output_field=models.DecimalField(decimal_places=4, max_digits=6),
+    )
+
+
+# Account fields Grafana can filter series by, with their ad-hoc filter type
+TAG_KEYS = {
+    'bank_name': 'string',
+    'account_name': 'string',
+    'instant_withdrawal': 'boolean',
+}
+# Filters are `(key, operator, value)`, the keys being `pk` or a tag key
+AccountFilter = Tuple[str, str, str]
+
+
+class AccountQuerySet(models.QuerySet):
+    def filtered(self, filters: Iterable[AccountFilter]) -> AccountQuerySet:
+        """Accounts matching every filter, using the `=`, `!=`, `=~` and `!~` operators of Grafana ad-hoc filters
+
+        Raises `ValidationError` for filters on other fields, other operators or values the field doesn't accept.
+        """
+        accounts = self
+        for key, operator, value in filters:
+            if key != 'pk' and key not in TAG_KEYS:
+                raise ValidationError(f"Can't filter accounts by {key}")
+            field = self.model._meta.pk if key == 'pk' else self.model._meta.get_field(key)
+            if operator in ('=~', '!~'):
+                try:
+                    re.compile(value)
+                except re.error as error:
+                    raise ValidationError(f"Invalid pattern for {key}: {error}")
+                condition = models.Q(**{f'{key}__regex': value})
+            elif operator in ('=', '!='):
+                if isinstance(field, models.BooleanField):
+                    value = str(value).lower() in ('true', '1', 't', 'yes')
+                condition = models.Q(**{key: field.to_python(value)})
+            else:
+                raise ValidationError(f"Unsupported filter operator {operator}")
+            accounts = accounts.exclude(condition) if operator.startswith('!') else accounts.filter(condition)
+        return accounts
+
+    def with_summary(self, recent_days: int = 90) -> AccountQuerySet:
+        """Annotate every value shown in account tables, computed in a single query
+
+        Adds `summary_starting_balance`, `summary_current_balance`, `summary_total_topup`, `summary_average_APR`,
+        `summary_recent_APR` (over the last `recent_days` days), `summary_returns` and `summary_balance_OK`, read
+        through `Account.summary`.
+        """
+        checks = Balance.objects.filter(account=models.OuterRef('pk'))
+        decimal = models.DecimalField(decimal_places=4, max_digits=10)
+        accounts = self.annotate(
+            summary_starting_balance=models.Subquery(checks.order_by('timestamp').values('balance')[:1],
+                                                     output_field=decimal),
+            summary_current_balance=models.Subquery(checks.order_by('-timestamp').values('balance')[:1],
+                                                    output_field=decimal),
+            summary_total_topup=models.Sum('balance__topup'),
+            summary_average_APR=weighted_APR('balance__'),
+            summary_recent_APR=weighted_APR('balance__', datetime.date.today() - datetime.timedelta(days=recent_days)),
+        )
+        return accounts.annotate(
+            summary_returns=models.ExpressionWrapper(
+                models.F('summary_current_balance') - models.F('summary_total_topup'), output_field=decimal
+            ),
+            summary_balance_OK=models.Case(
+                models.When(interest_min__isnull=True, interest_max__isnull=True, then=models.Value(True)),
+                models.When(summary_current_balance__isnull=True, then=models.Value(None)),
+                models.When(
+                    (models.Q(interest_min__isnull=True) | models.Q(interest_min__lte=models.F('summary_current_balance'))) &
+                    (models.Q(interest_max__isnull=True) | models.Q(interest_max__gte=models.F('summary_current_balance'))),
+                    then=models.Value(True),
+                ),
+                default=models.Value(False),
+                output_field=models.NullBooleanField(),
+            ),
+        )
+
+    def delete(self):
+        """Delete the accounts, without maintaining each of the balances deleted with them"""
+        with _setting(_deleted_accounts, _deleted_accounts.get() | set(self.values_list('pk', flat=True))):
+            return super().delete()
+
+
+def new_version() -> str:
+    return uuid.uuid4().hex
 
 
 # Create your models here.
@@ -22,6 +194,16 @@ class Account(models.Model):
 
     instant_withdrawal = models.BooleanField()
 
+    # Changed whenever the account or its balances are written, so every process can tell its cached data is stale
+    data_version = models.CharField(max_length=32, default=new_version, editable=False)
+
+    objects = AccountQuerySet.as_manager()
+
+    def delete(self, *args, **kwargs):
+        """Delete the account, without maintaining each of the balances deleted with it"""
+        with _setting(_deleted_accounts, _deleted_accounts.get() | {self.pk}):
+            return super().delete(*args, **kwargs)
+
     @property
     def starting_balance(self) -> Balance:
         """First available balance for this account"""
@@ -38,15 +220,13 @@ class Account(models.Model):
         return self.balance_set.aggregate(models.Sum('topup'))['topup__sum']
 
     @property
-    def average_APR(self) -> Optional[float]:
+    def average_APR(self) -> Optional[Decimal]:
         """Average yearly interest %"""
-        apr_set = []
-        for balance in self.balance_set.filter(APR__isnull=False):
-            apr_set += [balance.APR] * balance.days_since_last_check
-        if len(apr_set) > 0:
-            return sum(apr_set)/len(apr_set)
-        else:
-            return None
+        return self.balance_set.aggregate(average_APR=weighted_APR())['average_APR']
+
+    def average_APR_since(self, since: datetime.date) -> Optional[Decimal]:
+        """Average yearly interest % over the days after `since`"""
+        return self.balance_set.aggregate(average_APR=weighted_APR(since=since))['average_APR']
 
     @property
     def returns(self) -> Optional[Decimal]:
@@ -69,41 +249,261 @@ class Account(models.Model):
     def __str__(self):
         return f'{self.bank_name} - {self.account_name}'
 
+    def summary(self, name: str):
+        """Summary value annotated by `AccountQuerySet.with_summary`, falling back to the property of the same name"""
+        if hasattr(self, f'summary_{name}'):
+            return getattr(self, f'summary_{name}')
+        value = getattr(self, name)
+        return value.balance if isinstance(value, Balance) else value
+
     def starting_balance_localized(self):
-        if self.starting_balance:
-            return settings.CURRENCY_FORMAT.format(self.starting_balance.balance)
+        starting_balance = self.summary('starting_balance')
+        if starting_balance is not None:
+            return settings.CURRENCY_FORMAT.format(starting_balance)
         else:
             return "-"
     starting_balance_localized.short_description = 'Starting Balance'
 
     def current_balance_localized(self):
-        if self.current_balance:
-            return settings.CURRENCY_FORMAT.format(self.current_balance.balance)
+        current_balance = self.summary('current_balance')
+        if current_balance is not None:
+            return settings.CURRENCY_FORMAT.format(current_balance)
         else:
             return "-"
     current_balance_localized.short_description = 'Current Balance'
 
     def total_topup_localized(self):
-        if self.total_topup:
-            return settings.CURRENCY_FORMAT.format(self.total_topup)
+        total_topup = self.summary('total_topup')
+        if total_topup:
+            return settings.CURRENCY_FORMAT.format(total_topup)
         else:
             return "-"
     total_topup_localized.short_description = 'Total Topup'
 
     def average_APR_localized(self):
-        if self.average_APR:
-            return "{:.2%}".format(self.average_APR)
+        average_APR = self.summary('average_APR')
+        if average_APR:
+            return "{:.2%}".format(average_APR)
         else:
             return "-"
     average_APR_localized.short_description = 'Average APR'
 
     def returns_localized(self):
-        if self.returns:
-            return settings.CURRENCY_FORMAT.format(self.returns)
+        returns = self.summary('returns')
+        if returns:
+            return settings.CURRENCY_FORMAT.format(returns)
         else:
             return "-"
     returns_localized.short_description = 'Returns'
 
+    def balance_OK_localized(self):
+        return self.summary('balance_OK')
+    balance_OK_localized.short_description = 'Balance OK'
+    balance_OK_localized.boolean = True
+
+
+def supports_update_from(connection) -> bool:
+    """Whether the database accepts `UPDATE ... FROM (subquery)`"""
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 33, 0)
+    return connection.vendor == 'postgresql'
+
+
+class DecimalWindow(models.Window):
+    """Window expression that SQLite accepts when its function returns a decimal"""
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        if not isinstance(self.output_field, models.DecimalField):
+            return self.as_sql(compiler, connection, **extra_context)
+        # Django 3.0 casts decimal functions to NUMERIC before the OVER clause, which SQLite rejects
+        clone = self.copy()
+        function = clone.source_expression.copy()
+        function.output_field = models.FloatField()
+        clone.set_source_expressions([function, *clone.get_source_expressions()[1:]])
+        sql, params = clone.as_sql(compiler, connection, **extra_context)
+        return 'CAST(%s AS NUMERIC)' % sql, params
+
+
+class Previous(DecimalWindow):
+    """Value of a field at the previous check of the same account"""
+
+    def __init__(self, field: str):
+        super().__init__(Lag(field), partition_by=[models.F('account_id')], order_by=models.F('timestamp').asc())
+
+
+class Closing(DecimalWindow):
+    """Value of a field at the last check of the same account within the same bucket"""
+
+    def __init__(self, field: str, bucket: models.Expression):
+        super().__init__(
+            LastValue(field), partition_by=[models.F('account_id'), bucket], order_by=models.F('timestamp').asc(),
+            frame=models.RowRange(start=None, end=None),
+        )
+
+
+# Calendar buckets series can be aggregated into, with the first day of the bucket containing a date
+BUCKETS = {
+    'day': (TruncDay, lambda date: date),
+    'week': (TruncWeek, lambda date: date - datetime.timedelta(days=date.weekday())),
+    'month': (TruncMonth, lambda date: date.replace(day=1)),
+}
+
+
+def as_date(value) -> datetime.date:
+    """Date read from a raw cursor, which SQLite returns as text and PostgreSQL's date_trunc as a timestamp"""
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+class BalanceQuerySet(models.QuerySet):
+    def delete(self):
+        """Delete the balances, invalidating the data of each of their accounts once rather than for every balance"""
+        account_ids = set(self.order_by().values_list('account_id', flat=True).distinct())
+        with _setting(_bulk_delete, True):
+            deleted = super().delete()
+        balances_changed.send(sender=Balance, account_ids=account_ids)
+        return deleted
+
+    def between(self, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> BalanceQuerySet:
+        """Balances recorded within a date range, plus the last check before `start` for each account
+
+        The extra leading checks let `with_history` see the previous balance of the first check in range, callers
+        should drop them once the window functions have been evaluated.
+        """
+        balances = self
+        if end is not None:
+            balances = balances.filter(timestamp__lte=end)
+        if start is not None:
+            lead_in = Balance.objects.filter(
+                account=models.OuterRef('pk'), timestamp__lt=start
+            ).order_by('-timestamp').values('pk')[:1]
+            balances = balances.filter(
+                models.Q(timestamp__gte=start) |
+                models.Q(pk__in=Account.objects.annotate(lead_in=models.Subquery(lead_in)).values('lead_in'))
+            )
+        return balances
+
+    def with_history(self) -> BalanceQuerySet:
+        """Annotate each balance with values derived from the previous check, using window functions
+
+        Adds `previous_balance`, `previous_timestamp`, `days_elapsed`, `period_returns` and `period_APR`, matching
+        `previous_check`, `days_since_last_check`, `returns` and `APR` without a query per balance.
+        """
+        days = DaysBetween(Previous('timestamp'), models.F('timestamp'))
+        returns = models.ExpressionWrapper(
+            models.F('balance') - models.F('topup') - Previous('balance'),
+            output_field=models.DecimalField(decimal_places=4, max_digits=10),
+        )
+        return self.annotate(
+            previous_balance=Previous('balance'),
+            previous_timestamp=Previous('timestamp'),
+            days_elapsed=days,
+            period_returns=returns,
+            period_APR=Divide(
+                returns * 365, NullIf(Previous('balance') * days, 0),
+                output_field=models.DecimalField(decimal_places=4, max_digits=6),
+            ),
+        )
+
+    def refresh(self, pks: Collection[int], since: datetime.date) -> int:
+        """Rebuild the derived fields of the balances in `pks` and of the balance following each of them
+
+        `since` must be no later than the earliest of those balances, only balances from that date on are read.
+        Returns the number of balances updated.
+        """
+        derived = self.between(since).with_history().annotate(previous_id=Previous('id'))
+        rows = [
+            Balance(pk=pk, days_since_last_check=days, APR=APR)
+            for pk, previous_id, days, APR in derived.values_list('pk', 'previous_id', 'days_elapsed', 'period_APR')
+            if pk in pks or previous_id in pks
+        ]
+        Balance.objects.using(self._db or router.db_for_write(self.model)).bulk_update(
+            rows, ['days_since_last_check', 'APR'], batch_size=500
+        )
+        return len(rows)
+
+    def buckets(self, kind: str, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None
+                ) -> Iterator[Tuple[int, datetime.date, Decimal, Optional[Decimal], Optional[Decimal]]]:
+        """`(account_id, bucket, balance, APR, returns)` for each account and calendar bucket with balances
+
+        The bucket is the first day of each day, week or month. The balance is the last one in the bucket, returns are
+        summed and APR is averaged over the days covered. The buckets are aggregated by the database, from the window
+        functions of `with_history`, wrapped in a grouping query as aggregates can't be applied to them directly. Only
+        whole buckets are included, so the one containing `start` counts from its first day.
+        """
+        db = self._db or router.db_for_read(self.model)
+        connection = connections[db]
+        trunc, bucket_start = BUCKETS[kind]
+        if start is not None:
+            start = bucket_start(start)
+        bucket = trunc('timestamp', output_field=models.DateField())
+        rows = self.between(start, end).with_history().annotate(
+            bucket=bucket, closing_balance=Closing('balance', bucket),
+        ).values('account', 'bucket', 'closing_balance', 'days_elapsed', 'period_returns', 'period_APR')
+
+        qn = connection.ops.quote_name
+        rows_sql, params = rows.query.get_compiler(db).as_sql()
+        days = f'rows.{qn("days_elapsed")}'
+        rated = f'rows.{qn("period_APR")} IS NOT NULL AND {days} IS NOT NULL'
+        sql = (
+            f'SELECT rows.{qn("account_id")}, rows.{qn("bucket")}, MAX(rows.{qn("closing_balance")}), '
+            f'SUM(CASE WHEN {rated} THEN rows.{qn("period_APR")} * {days} END) / '
+            f'NULLIF(SUM(CASE WHEN {rated} THEN {days} END), 0), '
+            f'SUM(rows.{qn("period_returns")}) '
+            f'FROM ({rows_sql}) rows'
+        )
+        if start is not None:
+            # Drop the lead-in checks `between` adds before the range
+            sql += f' WHERE rows.{qn("bucket")} >= %s'
+            params = (*params, connection.ops.adapt_datefield_value(start))
+        sql += (f' GROUP BY rows.{qn("account_id")}, rows.{qn("bucket")}'
+                f' ORDER BY rows.{qn("account_id")}, rows.{qn("bucket")}')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for account_id, bucket_date, balance, APR, returns in cursor:
+                yield account_id, as_date(bucket_date), balance, APR, returns
+
+    def recompute(self, since: Optional[datetime.date] = None) -> int:
+        """Rebuild `days_since_last_check` and `APR` for these balances with a single set-based UPDATE
+
+        The window functions of `with_history` see every balance in the queryset, so filter it by account rather
+        than by date and use `since` to only rewrite balances recorded on or after that date. Returns the number of
+        balances updated.
+        """
+        db = self._db or router.db_for_write(self.model)
+        connection = connections[db]
+        derived = self.between(since).with_history().values('id', 'timestamp', 'days_elapsed', 'period_APR')
+
+        if not supports_update_from(connection):
+            rows = [
+                Balance(pk=pk, days_since_last_check=days, APR=APR)
+                for pk, timestamp, days, APR in derived.values_list('id', 'timestamp', 'days_elapsed', 'period_APR')
+                if since is None or timestamp >= since
+            ]
+            Balance.objects.using(db).bulk_update(rows, ['days_since_last_check', 'APR'], batch_size=500)
+            balances_changed.send(sender=Balance)
+            return len(rows)
+
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        derived_sql, params = derived.query.get_compiler(db).as_sql()
+        sql = (
+            f'UPDATE {table} SET {qn("days_since_last_check")} = derived.{qn("days_elapsed")}, '
+            f'{qn("APR")} = ROUND(derived.{qn("period_APR")}, 4) '
+            f'FROM ({derived_sql}) derived WHERE {table}.{qn("id")} = derived.{qn("id")}'
+        )
+        if since is not None:
+            sql += f' AND derived.{qn("timestamp")} >= %s'
+            params = (*params, connection.ops.adapt_datefield_value(since))
+        with transaction.atomic(using=db), connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            updated = cursor.rowcount
+        balances_changed.send(sender=Balance)
+        return updated
+
 
 class Balance(ComputedFieldsModel):
     """Point-in-time record of the balance for an account"""
@@ -112,18 +512,30 @@ class Balance(ComputedFieldsModel):
     balance = models.DecimalField(decimal_places=4, max_digits=10)
     topup = models.DecimalField(decimal_places=4, max_digits=10, default=0)
 
+    objects = BalanceQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'timestamp'], name='unique_balance_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['account', 'timestamp'], name='balance_topup_idx', condition=~models.Q(topup=0)),
+        ]
+
     @property
     def previous_check(self) -> Balance:
         """Most recent previous balance record for this account"""
-        return Balance.objects.filter(account=self.account, timestamp__lt=self.timestamp).order_by('timestamp').last()
+        return Balance.objects.filter(account_id=self.account_id, timestamp__lt=self.timestamp).order_by('timestamp').last()
+
+    @property
+    def following_check(self) -> Optional[Balance]:
+        """Next balance record for this account"""
+        return Balance.objects.filter(account_id=self.account_id, timestamp__gt=self.timestamp).order_by('timestamp').first()
 
     @computed(models.IntegerField(null=True), [['self', ['timestamp']]])
     def days_since_last_check(self) -> Optional[int]:
         """Number of days since the previous balance record"""
-        if self.previous_check:
-            return (self.timestamp - self.previous_check.timestamp).days
-        else:
-            return None
+        return self.days_after(self.previous_check)
 
     @property
     def interest_increase(self) -> Decimal:
@@ -133,20 +545,68 @@ class Balance(ComputedFieldsModel):
     @property
     def returns(self) -> Optional[Decimal]:
         """Amount generated from interest, etc."""
-        if self.previous_check:
-            return self.interest_increase - self.previous_check.balance
+        previous = self.previous_check
+        if previous is not None:
+            return self.interest_increase - previous.balance
         else:
             return None
 
     @computed(models.DecimalField(decimal_places=4, max_digits=6, null=True), depends=[['self', ['balance', 'topup', 'days_since_last_check']]])
     def APR(self) -> Optional[Decimal]:
         """Current yearly interest for the account, calculated since the last balance record"""
-        previous = self.previous_check
+        return self.APR_after(self.previous_check)
+
+    def days_after(self, previous: Optional[Balance]) -> Optional[int]:
+        """Number of days between `previous` and this balance record"""
+        if previous is not None:
+            return (self.timestamp - previous.timestamp).days
+        else:
+            return None
+
+    def APR_after(self, previous: Optional[Balance]) -> Optional[Decimal]:
+        """Yearly interest for the account, calculated since `previous`"""
         if previous is not None:
-            return (((self.interest_increase / previous.balance) - 1) / self.days_since_last_check) * 365
+            return (((self.interest_increase / previous.balance) - 1) / self.days_after(previous)) * 365
         else:
             return None
 
+    def follow(self, previous: Optional[Balance]):
+        """Store the derived fields of this record after `previous` became the record before it"""
+        self.days_since_last_check = self.days_after(previous)
+        self.APR = self.APR_after(previous)
+        Balance.objects.filter(pk=self.pk).update(days_since_last_check=self.days_since_last_check, APR=self.APR)
+
+    @staticmethod
+    def refresh_after(account_id: int, timestamp: datetime.date):
+        """Update the derived fields of the first record after `timestamp`, once the record before it has changed"""
+        following = Balance.objects.filter(account_id=account_id, timestamp__gt=timestamp).order_by('timestamp').first()
+        if following is not None:
+            following.follow(following.previous_check)
+
+    def save(self, *args, **kwargs):
+        """Save the record and update the derived fields of the records following its old and new position
+
+        Only the neighbouring records are touched, deletes are handled by `signals.refresh_following_check`.
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'account', 'timestamp', 'balance', 'topup'} & set(update_fields):
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Balance, instance=self)):
+            stored = None
+            if self.pk is not None:
+                stored = Balance.objects.filter(pk=self.pk).values_list('account_id', 'timestamp').first()
+            super().save(*args, **kwargs)
+
+            following = self.following_check
+            if following is not None:
+                following.follow(self)
+            if stored is not None and stored != (self.account_id, self.timestamp):
+                Balance.refresh_after(*stored)
+                if stored[0] != self.account_id:
+                    # The save signals only invalidate the account the balance moved to
+                    balances_changed.send(sender=Balance, account_ids=[stored[0]])
+
     def __str__(self):
         return f"{self.account} Balance on {self.timestamp} - {settings.CURRENCY_FORMAT}".format(self.balance)
 
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import datetime
+import heapq
+import itertools
+import operator
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.db import models as db
+
+from . import models
+from .downsampling import lttb
+from .loader import epoch_ms, number
+
+# Totals a portfolio series can show, from an account's balance and the topups it has received so far
+VALUES = {
+    'balance': lambda balance, topups: balance,
+    'topups': lambda balance, topups: topups,
+    'returns': lambda balance, topups: balance - topups,
+}
+# Account fields a portfolio can be split by
+GROUPS = ('bank_name',)
+
+Check = Tuple[datetime.date, int, Decimal, Decimal]
+
+
+def checks(start: Optional[datetime.date], end: Optional[datetime.date], filters: Sequence[models.AccountFilter] = ()
+           ) -> Tuple[Dict[int, str], List[Check], List[List[Check]]]:
+    """Bank of every account, the state of each account at `start` and a stream of later checks for each account
+
+    States and checks are `(timestamp, account_id, balance, topups)`, where `topups` counts every topup received up to
+    that check. Each stream is ordered by timestamp. Only accounts matching the filters are included.
+    """
+    accounts = models.Account.objects.filtered(filters).order_by('pk')
+    if start is not None:
+        before = models.Balance.objects.filter(account=db.OuterRef('pk'), timestamp__lt=start).order_by('-timestamp')
+        accounts = accounts.annotate(
+            opening_balance=db.Subquery(before.values('balance')[:1]),
+            opening_topups=db.Sum('balance__topup', filter=db.Q(balance__timestamp__lt=start)),
+        )
+    else:
+        accounts = accounts.annotate(
+            opening_balance=db.Value(None, db.DecimalField()),
+            opening_topups=db.Value(None, db.DecimalField()),
+        )
+    banks = {}
+    openings = []
+    for pk, bank_name, balance, topups in accounts.values_list('pk', 'bank_name', 'opening_balance', 'opening_topups'):
+        banks[pk] = bank_name
+        if balance is not None:
+            openings.append((start, pk, balance, topups or Decimal(0)))
+
+    balances = models.Balance.objects.all()
+    if filters:
+        balances = balances.filter(account__in=models.Account.objects.filtered(filters).values('pk'))
+    if start is not None:
+        balances = balances.filter(timestamp__gte=start)
+    if end is not None:
+        balances = balances.filter(timestamp__lte=end)
+    topups = {pk: topups for _, pk, _, topups in openings}
+    streams = []
+    for account_id, rows in itertools.groupby(
+        balances.order_by('account', 'timestamp').values_list('account', 'timestamp', 'balance', 'topup'),
+        key=operator.itemgetter(0),
+    ):
+        received = topups.get(account_id, Decimal(0))
+        stream = []
+        for _, timestamp, balance, topup in rows:
+            received += topup
+            stream.append((timestamp, account_id, balance, received))
+        streams.append(stream)
+    return banks, openings, streams
+
+
+def totals(openings: List[Check], streams: List[List[Check]], group_of: Dict[int, str], value: str,
+           start: Optional[datetime.date] = None) -> Iterator[Tuple[datetime.date, Dict[str, Decimal]]]:
+    """Total `value` of each group whenever a check changes it, carrying the last value of every account forward
+
+    The totals of the accounts checked before the range are given at `start`. The streams are merged in timestamp
+    order in a single pass, updating the totals by the difference each check makes.
+    """
+    measure = VALUES[value]
+    current: Dict[int, Decimal] = {}
+    total: Dict[str, Decimal] = {}
+    for _, account_id, balance, topups in openings:
+        current[account_id] = measure(balance, topups)
+        group = group_of[account_id]
+        total[group] = total.get(group, Decimal(0)) + current[account_id]
+    opening = dict(total)
+
+    for timestamp, changes in itertools.groupby(heapq.merge(*streams), key=operator.itemgetter(0)):
+        changed = {}
+        if opening and timestamp > start:
+            yield start, opening
+        elif opening:
+            changed = opening
+        opening = None
+        for _, account_id, balance, topups in changes:
+            new = measure(balance, topups)
+            group = group_of[account_id]
+            total[group] = total.get(group, Decimal(0)) + new - current.get(account_id, Decimal(0))
+            current[account_id] = new
+            changed[group] = total[group]
+        yield timestamp, changed
+    if opening:
+        yield start, opening
+
+
+def portfolio(start: Optional[datetime.date] = None, end: Optional[datetime.date] = None, value: str = 'balance',
+              group_by: Optional[str] = None, limit: Optional[int] = None,
+              filters: Sequence[models.AccountFilter] = ()) -> list:
+    """Grafana series of the total `value` across the accounts matching the filters, or across those of each bank"""
+    banks, openings, streams = checks(start, end, filters)
+    group_of = banks if group_by == 'bank_name' else dict.fromkeys(banks, 'Total')
+    datapoints = {}
+    for timestamp, changed in totals(openings, streams, group_of, value, start):
+        for group, total in changed.items():
+            datapoints.setdefault(group, []).append([number(total), epoch_ms(timestamp)])
+    return [
+        {
+            "target": f"{group} {value}",
+            "datapoints": lttb(datapoints[group], limit) if limit else datapoints[group],
+        }
+        for group in sorted(datapoints)
+    ]
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import cProfile
+import datetime
+import os
+import pstats
+import threading
+import time
+from typing import Any, Callable, List, Optional, TypeVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from . import metrics
+
+T = TypeVar('T')
+
+# Functions listed for each target, by cumulative time
+FUNCTIONS = 25
+
+
+class Profiler:
+    """Profile of a Grafana query, broken down by the targets it evaluates
+
+    Each target is run under its own cProfile profiler, in whichever thread evaluates it, with every SQL statement it
+    runs captured along with its time. The snapshot shared by series targets is profiled as `snapshot`.
+    """
+
+    def __init__(self, explain: bool = False):
+        self.explain = explain
+        self.targets: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def measured(self, target: str, task: Callable[[], T]) -> T:
+        """Result of evaluating part of a Grafana target, profiling it, for use in place of `metrics.measured`"""
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        with metrics.measuring(capture=True) as queries:
+            profile.enable()
+            try:
+                return task()
+            finally:
+                profile.disable()
+                with self._lock:
+                    self.targets.append((target, time.perf_counter() - started, profile, queries))
+
+    def summary(self) -> dict:
+        """Time, slowest functions and SQL statements of each target, also written to `PROFILE_DIR` when it is set"""
+        summary = {
+            "targets": [
+                {
+                    "target": target,
+                    "seconds": seconds,
+                    "functions": functions(profile),
+                    "queries": [
+                        {"sql": sql, "params": params, "seconds": duration,
+                         **({"plan": explain(alias, sql, params)} if self.explain and not many else {})}
+                        for alias, sql, params, many, duration in queries.statements
+                    ],
+                }
+                for target, seconds, profile, queries in self.targets
+            ],
+        }
+        if settings.PROFILE_DIR:
+            summary["file"] = self.dump(settings.PROFILE_DIR)
+        return summary
+
+    def dump(self, directory: str) -> Optional[str]:
+        """Write the profiles of every target as one pstats file in `directory`, for snakeviz or `python -m pstats`"""
+        profiles = [profile for _, _, profile, _ in self.targets]
+        if not profiles:
+            return None
+        stats = pstats.Stats(*profiles)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"query-{datetime.datetime.now():%Y%m%d-%H%M%S-%f}.prof")
+        stats.dump_stats(path)
+        return path
+
+
+def functions(profile: cProfile.Profile, limit: int = FUNCTIONS) -> List[dict]:
+    """The `limit` functions a profile spent the most cumulative time in"""
+    profile.create_stats()
+    rows = sorted(profile.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": pstats.func_std_string(function),
+            "calls": calls,
+            "seconds": round(own, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        }
+        for function, (_, calls, own, cumulative, _) in rows
+    ]
+
+
+def explain(alias: str, sql: str, params: Any) -> List[list]:
+    """Query plan of a captured SELECT statement, from the database it ran on"""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return []
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            return [list(row) for row in cursor.fetchall()]
+    except DatabaseError as error:
+        return [[str(error)]]
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+import math
+from typing import List, Optional, Sequence
+
+from django.db import models as db
+
+from . import models
+from .loader import epoch_ms, number
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Interest rates a projection can compound
+RATES = ('predicted', 'average')
+
+
+def sample_dates(start: datetime.date, end: datetime.date, kind: str) -> List[datetime.date]:
+    """First day of every day, week or month from `start` to `end`"""
+    _, bucket_start = models.BUCKETS[kind]
+    dates = []
+    date = bucket_start(start)
+    while date <= end:
+        if date >= start:
+            dates.append(date)
+        date = bucket_start(date + datetime.timedelta(days=31 if kind == 'month' else 7 if kind == 'week' else 1))
+    return dates
+
+
+def project(balances: Sequence[float], rates: Sequence[float], floors: Sequence[float], caps: Sequence[float],
+            since: Sequence[int], days: Sequence[int]) -> List[List[float]]:
+    """Balance of each account on each of `days`, with its yearly rate compounded daily from its day in `since`
+
+    Only the part of a balance up to its cap earns interest, and a balance under its floor earns none, so the balance
+    grows geometrically until it reaches the cap and linearly after that. That has a closed form, computed for every
+    account and day at once with NumPy when it is installed. Days before the one an account starts from give its balance.
+    """
+    if numpy is None:
+        return [
+            [project_one(balance, rate, floor, cap, day - start) for day in days]
+            for balance, rate, floor, cap, start in zip(balances, rates, floors, caps, since)
+        ]
+
+    balance, rate, floor, cap = (
+        numpy.asarray(values, dtype=float)[:, None] for values in (balances, rates, floors, caps)
+    )
+    elapsed = numpy.maximum(numpy.asarray(days, dtype=float)[None, :] - numpy.asarray(since, dtype=float)[:, None], 0)
+    growth = 1 + rate / 365
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        to_cap = numpy.where(
+            balance >= cap, 0,
+            numpy.where(rate > 0, numpy.ceil(numpy.log(cap / balance) / numpy.log(growth)), numpy.inf),
+        )
+        compounded = numpy.minimum(elapsed, to_cap)
+        projected = balance * growth ** compounded + numpy.where(
+            elapsed > compounded, rate / 365 * cap * (elapsed - compounded), 0
+        )
+    projected = numpy.where(balance < floor, balance, projected)
+    return projected.round(4).tolist()
+
+
+def project_one(balance: float, rate: float, floor: float, cap: float, elapsed: int) -> float:
+    if elapsed <= 0 or balance < floor:
+        return balance
+    growth = 1 + rate / 365
+    if balance >= cap:
+        compounded = 0
+    elif rate > 0 and cap < math.inf:
+        compounded = min(elapsed, math.ceil(math.log(cap / balance) / math.log(growth)))
+    else:
+        compounded = elapsed
+    projected = balance * growth ** compounded
+    if elapsed > compounded:
+        projected += rate / 365 * cap * (elapsed - compounded)
+    return round(projected, 4)
+
+
+def projections(start: datetime.date, end: datetime.date, kind: str = 'day', rate: str = 'predicted',
+                limit: Optional[int] = None, filters: Sequence[models.AccountFilter] = ()) -> list:
+    """One Grafana series per account matching the filters, projecting its current balance from its last check to `end`
+
+    Accounts grow at their `predicted_interest`, or at the `average_APR` observed so far with `rate='average'`,
+    within their `interest_min` and `interest_max`. Points are at the start of each day, week or month from `start`,
+    skipping evenly between them to stay within `limit`, as projections are smooth.
+    """
+    checks = models.Balance.objects.filter(account=db.OuterRef('pk')).order_by('-timestamp')
+    accounts = models.Account.objects.filtered(filters).annotate(
+        projection_balance=db.Subquery(checks.values('balance')[:1]),
+        projection_since=db.Subquery(checks.values('timestamp')[:1]),
+    ).filter(projection_balance__isnull=False).order_by('pk')
+    if rate == 'average':
+        accounts = accounts.annotate(projection_rate=models.weighted_APR('balance__'))
+    else:
+        accounts = accounts.annotate(projection_rate=db.F('predicted_interest'))
+    accounts = list(accounts.only('bank_name', 'account_name', 'interest_min', 'interest_max'))
+    if not accounts:
+        return []
+
+    origin = min(account.projection_since for account in accounts)
+    dates = sample_dates(max(start, origin), end, kind)
+    if limit and len(dates) > limit:
+        dates = dates[::math.ceil(len(dates) / limit)]
+    timestamps = [epoch_ms(date) for date in dates]
+    days = [(date - origin).days for date in dates]
+    projected = project(
+        [float(account.projection_balance) for account in accounts],
+        [number(account.projection_rate) or 0.0 for account in accounts],
+        [number(account.interest_min) if account.interest_min is not None else 0.0 for account in accounts],
+        [number(account.interest_max) if account.interest_max is not None else math.inf for account in accounts],
+        [(account.projection_since - origin).days for account in accounts],
+        days,
+    )
+    response = []
+    for account, balances in zip(accounts, projected):
+        first = bisect.bisect_left(days, (account.projection_since - origin).days)
+        response.append({
+            "target": f"{account} (projected)",
+            "datapoints": [[value, timestamp] for value, timestamp in zip(balances[first:], timestamps[first:])],
+        })
+    return response
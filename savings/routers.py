@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+from typing import Iterable, Iterator
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+
+_read_only: contextvars.ContextVar[bool] = contextvars.ContextVar('read_only', default=False)
+
+
+class ReplicaRouter:
+    """Sends the reads of `read_only` views to the `replica` database when one is configured, everything else to
+    `default`
+
+    The replica holds the same data, as a streaming replica or a snapshot, so relations are allowed across them. It is
+    never migrated, the tables come from `default`. Read-only views also read the accounts' data versions from the
+    replica, so a response built from a lagging replica is cached under the versions it was built from, rather than
+    under those of writes the replica hasn't received yet.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_only.get() and REPLICA in connections.databases:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+def replica_reads(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Chunks of a streamed response, read from the replica like the view that returned it"""
+    chunks = iter(chunks)
+    done = object()
+    while True:
+        token = _read_only.set(True)
+        try:
+            chunk = next(chunks, done)
+        finally:
+            _read_only.reset(token)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def read_only(view):
+    """Decorator for views that only read, such as those of the Grafana API, so their queries can go to the replica
+
+    Worker threads evaluating targets run in a copy of the request's context, so they read from the replica too.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _read_only.reset(token)
+        if response.streaming:
+            response.streaming_content = replica_reads(response.streaming_content)
+        return response
+    return wrapper
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import metrics, models
+from .cache import query_cache
+from .snapshot import snapshot
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Count the SQL queries of every request and Grafana target, for /metrics"""
+    metrics.install(connection)
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    """Close persistent connections that stopped working, e.g. after a database restart, so the request reconnects"""
+    if not settings.SQL_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and not connection.is_usable():
+            connection.close()
+
+
+@receiver(request_started)
+def refresh_snapshot(sender, **kwargs):
+    """Keep the read-only snapshot standing in for a replica up to date, when there is one"""
+    if snapshot is not None:
+        snapshot.refresh_if_stale()
+
+
+@receiver(post_delete, sender=models.Balance)
+def refresh_following_check(sender, instance: models.Balance, **kwargs):
+    """Update the derived fields of the record after a deleted balance, which now follows an older record, unless the
+    account is being deleted too"""
+    if models.deleting_account(instance.account_id):
+        return
+    models.Balance.refresh_after(instance.account_id, instance.timestamp)
+
+
+@receiver(post_save, sender=models.Balance)
+@receiver(post_delete, sender=models.Balance)
+def invalidate_balance(sender, instance: models.Balance, **kwargs):
+    """Drop cached responses that include the balance's account, left to the delete for accounts and querysets"""
+    if models.deleting_account(instance.account_id) or models.deleting_in_bulk():
+        return
+    query_cache.bump([instance.account_id])
+
+
+@receiver(post_save, sender=models.Account)
+def invalidate_account(sender, instance: models.Account, created: bool, **kwargs):
+    """Drop cached responses that include an edited account, those of new or deleted accounts change with the list"""
+    if not created:
+        query_cache.bump([instance.pk])
+
+
+@receiver(models.balances_changed)
+def invalidate_bulk(sender, account_ids=None, **kwargs):
+    """Drop cached responses after balances are written in bulk, all of them if the accounts aren't known"""
+    if account_ids is None:
+        query_cache.bump_all()
+    else:
+        query_cache.bump(account_ids)
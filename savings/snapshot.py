@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+# Pages copied at a time, letting writes to the source through between steps
+BACKUP_PAGES = 4096
+
+
+class Snapshot:
+    """Copy of the SQLite `default` database, opened read-only as the `replica` to stand in for a second server
+
+    The copy is made with SQLite's online backup, writing into the snapshot file in place so that connections to it
+    see the new data from their next query. Once it is older than `max_age` seconds, the next request refreshes it in a
+    background thread. The data versions of the accounts are copied with the balances, so responses cached from the
+    old copy are keyed by its versions and are never served for the new one.
+    """
+
+    def __init__(self, path: str, max_age: float):
+        source = settings.DATABASES[DEFAULT_DB_ALIAS]
+        if source['ENGINE'] != 'django.db.backends.sqlite3':
+            raise ImproperlyConfigured("SQL_REPLICA_SNAPSHOT needs the default database to be SQLite")
+        self.source = source['NAME']
+        self.path = path
+        self.max_age = max_age
+        self.refreshed: Optional[float] = None
+        self._copying = threading.Lock()
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self):
+        """Copy the default database into the snapshot now"""
+        with self._copying:
+            started = time.monotonic()
+            source = sqlite3.connect(self.source)
+            target = sqlite3.connect(self.path)
+            try:
+                source.backup(target, pages=BACKUP_PAGES)
+            finally:
+                target.close()
+                source.close()
+            self.refreshed = time.monotonic()
+            logger.info("Refreshed database snapshot %s in %.2fs", self.path, self.refreshed - started)
+
+    def refresh_if_stale(self):
+        """Refresh a missing snapshot before returning, or a stale one in the background"""
+        if self.refreshed is None and not os.path.exists(self.path):
+            self.refresh()
+            return
+        if self.refreshed is not None and time.monotonic() - self.refreshed < self.max_age:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name='savings-snapshot', daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except sqlite3.Error:
+            logger.exception("Could not refresh database snapshot %s", self.path)
+        finally:
+            self._refreshing = False
+
+    def age(self) -> Optional[float]:
+        return time.monotonic() - self.refreshed if self.refreshed is not None else None
+
+
+snapshot = Snapshot(settings.REPLICA_SNAPSHOT, settings.REPLICA_SNAPSHOT_SECONDS) if settings.REPLICA_SNAPSHOT else None
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+import math
+import sys
+import threading
+from array import array
+from typing import Dict, Iterable, Optional, Set
+
+from . import models
+from .cache import query_cache
+from .downsampling import lttb
+from .loader import epoch_ms
+
+
+class AccountSeries:
+    """Balances of one account as compact arrays ordered by timestamp, with NaN for missing values"""
+    __slots__ = ('name', 'timestamps', 'balance', 'APR', 'returns')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timestamps = array('q')
+        self.balance = array('d')
+        self.APR = array('d')
+        self.returns = array('d')
+
+    def datapoints(self, field: str, start: Optional[int] = None, end: Optional[int] = None) -> list:
+        """Grafana datapoints of `field` from `start` to `end` inclusive, in epoch milliseconds"""
+        low = bisect.bisect_left(self.timestamps, start) if start is not None else 0
+        high = bisect.bisect_right(self.timestamps, end) if end is not None else len(self.timestamps)
+        values = getattr(self, field)[low:high]
+        return [[None if math.isnan(value) else value, timestamp]
+                for value, timestamp in zip(values, self.timestamps[low:high])]
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + sum(sys.getsizeof(getattr(self, field)) for field in self.__slots__)
+
+
+class SeriesStore:
+    """Process-local copy of every series, answering range requests without querying the database
+
+    Accounts are loaded on first use, and an account is reloaded when its data version has changed since it was
+    loaded. Versions are read from the database on every request, so writes made through other processes, such as
+    imports and other workers, are picked up too, and deleted accounts are dropped.
+    """
+
+    def __init__(self):
+        self.accounts: Dict[int, AccountSeries] = {}
+        self.versions: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self) -> Dict[int, AccountSeries]:
+        """Every account, ordered by primary key, after reloading the ones that changed"""
+        # Read the versions first, so that writes made while loading cause another reload
+        versions = query_cache.account_versions()
+        with self._lock:
+            stale = {pk for pk, version in versions.items() if self.versions.get(pk) != version}
+            if stale or versions.keys() != self.versions.keys():
+                accounts = {pk: series for pk, series in self.accounts.items() if pk in versions and pk not in stale}
+                accounts.update(self.load(stale, everything=stale == set(versions)))
+                self.accounts = dict(sorted(accounts.items()))
+            self.versions = versions
+            return self.accounts
+
+    @staticmethod
+    def load(account_ids: Iterable[int], everything: bool = False) -> Dict[int, AccountSeries]:
+        accounts = models.Account.objects.only('bank_name', 'account_name')
+        balances = models.Balance.objects.all()
+        if not everything:
+            accounts = accounts.filter(pk__in=account_ids)
+            balances = balances.filter(account_id__in=account_ids)
+        loaded = {account.pk: AccountSeries(str(account)) for account in accounts}
+        for account_id, timestamp, balance, APR, returns in balances.with_history().order_by(
+            'account', 'timestamp'
+        ).values_list('account', 'timestamp', 'balance', 'period_APR', 'period_returns'):
+            series = loaded.get(account_id)
+            if series is None:
+                continue
+            series.timestamps.append(epoch_ms(timestamp))
+            series.balance.append(float(balance))
+            series.APR.append(float(APR) if APR is not None else math.nan)
+            series.returns.append(float(returns) if returns is not None else math.nan)
+        return loaded
+
+    def series(self, field: str, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+               limit: Optional[int] = None, account_ids: Optional[Set[int]] = None) -> list:
+        """Same as `QueryLoader.series`, for every account or those in `account_ids`"""
+        start_ms = epoch_ms(start) if start is not None else None
+        end_ms = epoch_ms(end) if end is not None else None
+        response = []
+        for pk, series in self.refresh().items():
+            if account_ids is not None and pk not in account_ids:
+                continue
+            datapoints = series.datapoints(field, start_ms, end_ms)
+            response.append({
+                "target": series.name,
+                "datapoints": lttb(datapoints, limit) if limit else datapoints,
+            })
+        return response
+
+    def stats(self) -> dict:
+        """Memory held by the loaded series"""
+        points = sum(len(series.timestamps) for series in self.accounts.values())
+        size = sys.getsizeof(self.accounts) + sum(sys.getsizeof(series) for series in self.accounts.values())
+        return {
+            "accounts": len(self.accounts),
+            "points": points,
+            "bytes": size,
+            "bytes_per_million_points": size * 1_000_000 // points if points else None,
+        }
+
+
+series_store = SeriesStore()
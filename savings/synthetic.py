@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import datetime
+import random
+from decimal import Decimal
+from typing import List, Tuple
+
+from django.db import connections, transaction
+
+from . import models
+
+BANKS = ('Northwind', 'Contoso', 'Fabrikam', 'Tailspin', 'Woodgrove', 'Litware', 'Proseware', 'Adventure Works')
+START = datetime.date(2015, 1, 1)
+
+
+def account(index: int, seed: int) -> models.Account:
+    """The `index`th synthetic account, the same for a given seed whatever the number of accounts generated"""
+    rnd = random.Random(f'{seed}-account-{index}')
+    capped = rnd.random() < 0.3
+    return models.Account(
+        bank_name=BANKS[index % len(BANKS)],
+        account_name=f'Saver {index + 1}',
+        predicted_interest=Decimal(rnd.randrange(50, 500)) / 10000,
+        interest_min=Decimal(rnd.choice([1, 100, 1000])) if capped else None,
+        interest_max=Decimal(rnd.choice([5000, 20000, 50000])) if capped else None,
+        instant_withdrawal=rnd.random() < 0.5,
+    )
+
+
+def checks(account: models.Account, index: int, seed: int, days: int, step: int, start: datetime.date
+           ) -> List[Tuple[datetime.date, float, float]]:
+    """`(timestamp, balance, topup)` of each check of a synthetic account, every `step` days for `days` days
+
+    Interest is compounded daily at a rate drifting around the predicted one, with the occasional topup or
+    withdrawal. Balances stay within the range the `Balance` fields can store.
+    """
+    rnd = random.Random(f'{seed}-balances-{index}')
+    rate = float(account.predicted_interest)
+    balance = float(rnd.randrange(100, 20000))
+    rows = []
+    for day in range(0, days, step):
+        rate = min(max(rate + rnd.gauss(0, 0.0005), 0.0), 0.08)
+        balance *= (1 + rate / 365) ** (step if day else 0)
+        topup = 0.0
+        if day and rnd.random() < 0.02 * step:
+            topup = float(rnd.randrange(50, 2000)) if rnd.random() < 0.7 else -round(balance * rnd.random() / 2, 2)
+        balance = min(balance + topup, 500000.0)
+        rows.append((start + datetime.timedelta(days=day), round(balance, 4), topup))
+    return rows
+
+
+def clear(using: str = 'default'):
+    """Delete every account and balance with two statements, rather than deleting and signalling each balance"""
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for model in (models.Balance, models.Account):
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+    models.balances_changed.send(sender=models.Balance)
+
+
+def generate(accounts: int = 10, days: int = 365, step: int = 1, seed: int = 0, start: datetime.date = START,
+             using: str = 'default') -> int:
+    """Create `accounts` synthetic accounts with a check every `step` days for `days` days, returning the balances made
+
+    The data only depends on the arguments, so runs at the same scale are comparable. Balances are inserted in bulk,
+    bypassing `Balance.save`, and their derived fields are computed afterwards by `recompute`.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    table = qn(models.Balance._meta.db_table)
+    columns = ', '.join(qn(column) for column in ('account_id', 'timestamp', 'balance', 'topup'))
+    created = 0
+    with transaction.atomic(using=using):
+        pks = []
+        for index in range(accounts):
+            synthetic = account(index, seed)
+            synthetic.save(using=using)
+            pks.append(synthetic.pk)
+            rows = [
+                (synthetic.pk, connection.ops.adapt_datefield_value(timestamp), balance, topup)
+                for timestamp, balance, topup in checks(synthetic, index, seed, days, step, start)
+            ]
+            with connection.cursor() as cursor:
+                cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s)', rows)
+            created += len(rows)
+        models.Balance.objects.using(using).filter(account__in=pks).recompute()
+    return created
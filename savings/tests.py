@@ -1,3 +1,572 @@
-from django.test import TestCase
+"""Tests of the balance write paths, and benchmarks of the Grafana API, `Account` properties and admin changelists
 
-# Create your tests here.
+The benchmarks only run when `BENCHMARK_SCALES` lists the scales to run them at, as `<accounts>x<days>`, e.g.
+`10x365,100x3650,1000x3650`. Each one runs on synthetic data, asserts an upper bound on the SQL queries it runs, which
+does not grow with the data, and records its timings. Results are written as JSON to `BENCHMARK_RESULTS`, printing how
+each benchmark changed since the results already there.
+"""
+import datetime
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+
+from . import importers, models
+from .cache import query_cache
+from .store import SeriesStore
+from .synthetic import START, generate
+
+SCALES = [
+    tuple(int(part) for part in scale.split('x'))
+    for scale in os.environ.get('BENCHMARK_SCALES', '').split(',') if scale
+]
+REPEAT = int(os.environ.get('BENCHMARK_REPEAT', 3))
+RESULTS = os.environ.get('BENCHMARK_RESULTS', os.path.join(tempfile.gettempdir(), 'savings-benchmarks.json'))
+
+# Upper bounds on the SQL queries of a /query for each target, one of them looking up the response cache versions
+TARGET_QUERIES = {
+    'accounts': 2,
+    'balances': 3,
+    'APRs': 3,
+    'returns': 3,
+    'balances by month': 3,
+    'projection': 2,
+    'portfolio': 3,
+}
+PROPERTY_QUERIES = {
+    'starting_balance': 1,
+    'current_balance': 1,
+    'total_topup': 1,
+    'average_APR': 1,
+    'returns': 3,
+    # The current balance is read again for each of the account's limits
+    'balance_OK': 3,
+}
+# Sessions, user, counts and page of results, with no query per row
+CHANGELIST_QUERIES = 8
+
+results: List[dict] = []
+
+
+def tearDownModule():
+    if not results:
+        return
+    previous = {}
+    if os.path.exists(RESULTS):
+        with open(RESULTS) as file:
+            previous = {(result['scale'], result['name']): result for result in json.load(file).get('results', [])}
+    if previous:
+        print(f"\nBenchmarks compared with the previous run in {RESULTS}:")
+    for result in results:
+        before = previous.get((result['scale'], result['name']))
+        if before and before['median_ms']:
+            change = result['median_ms'] / before['median_ms'] - 1
+            print(f"{result['scale']} {result['name']}: {result['median_ms']:.1f}ms ({change:+.0%})")
+    with open(RESULTS, 'w') as file:
+        json.dump({'run': datetime.datetime.now().isoformat(), 'results': results}, file, indent=2)
+
+
+def quiet_request_logging(case: TestCase):
+    """Only log failed requests until the end of the test"""
+    logger = logging.getLogger('django.request')
+    case.addCleanup(logger.setLevel, logger.level)
+    logger.setLevel(logging.ERROR)
+
+
+class Benchmark:
+    """Benchmarks at the scale of `accounts` accounts with a daily check for `days` days, mixed into a `TestCase`"""
+    accounts: int
+    days: int
+
+    @classmethod
+    def setUpTestData(cls):
+        generate(cls.accounts, cls.days)
+        cls.end = START + datetime.timedelta(days=cls.days - 1)
+        cls.admin = User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+
+    def setUp(self):
+        # Request logging would dominate the timings
+        quiet_request_logging(self)
+
+    def benchmark(self, name: str, run: Callable[[], object], max_queries: int) -> object:
+        """Result of `run`, timed `REPEAT` times after a warm-up, failing if any run exceeds `max_queries`"""
+        timings = []
+        for _ in range(REPEAT + 1):
+            query_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                result = run()
+                timings.append((time.perf_counter() - started) * 1000)
+            self.assertLessEqual(len(queries), max_queries, f"{name} ran {len(queries)} queries")
+        results.append({
+            'scale': f'{self.accounts}x{self.days}',
+            'name': name,
+            'median_ms': statistics.median(timings[1:]),
+            'min_ms': min(timings[1:]),
+            'queries': len(queries),
+            'max_queries': max_queries,
+        })
+        return result
+
+    def query(self, **target) -> Callable[[], list]:
+        body = json.dumps({
+            "range": {"from": f"{START}T00:00:00Z", "to": f"{self.end}T23:59:59Z"},
+            "intervalMs": 86400000,
+            "maxDataPoints": 1000,
+            "targets": [target],
+        })
+
+        def post() -> list:
+            response = self.client.post('/query', body, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.content)
+        return post
+
+    def test_query_targets(self):
+        for name, max_queries in TARGET_QUERIES.items():
+            target, _, bucket = name.partition(' by ')
+            with self.subTest(target=name):
+                response = self.benchmark(
+                    f'/query {name}', self.query(target=target, **({"data": {"bucket": bucket}} if bucket else {})),
+                    max_queries,
+                )
+                self.assertTrue(response)
+
+    def test_account_properties(self):
+        account = models.Account.objects.order_by('pk')[self.accounts // 2]
+        for name, max_queries in PROPERTY_QUERIES.items():
+            with self.subTest(property=name):
+                self.benchmark(f'Account.{name}', lambda: getattr(account, name), max_queries)
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin)
+        for model in ('account', 'balance'):
+            with self.subTest(model=model):
+                get = lambda: self.assertEqual(self.client.get(f'/admin/savings/{model}/').status_code, 200)
+                self.benchmark(f'{model} changelist', get, CHANGELIST_QUERIES)
+
+
+def benchmark_case(accounts: int, days: int) -> type:
+    name = f'Benchmark{accounts}x{days}'
+    case = type(name, (Benchmark, TestCase), {'accounts': accounts, 'days': days, '__module__': __name__})
+    # Worker threads would not see the test's uncommitted data, and the formatted admin values need a currency
+    return override_settings(QUERY_WORKERS=1, CURRENCY_FORMAT='£{:,.2f}')(case)
+
+
+for scale in SCALES:
+    globals()[f'Benchmark{scale[0]}x{scale[1]}'] = benchmark_case(*scale)
+
+
+class DerivedFieldsTestCase(TestCase):
+    """Checks the stored derived fields of balances against those computed from their previous check"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = models.Account.objects.create(
+            bank_name='Bank', account_name='Saver', predicted_interest=Decimal('0.02'), instant_withdrawal=True
+        )
+
+    def setUp(self):
+        quiet_request_logging(self)
+
+    def check(self, day: int, balance: str, topup: str = '0', account: Optional[models.Account] = None
+              ) -> models.Balance:
+        check = models.Balance(account=account or self.account, timestamp=datetime.date(2022, 1, day),
+                               balance=Decimal(balance), topup=Decimal(topup))
+        check.save()
+        return check
+
+    def assertDerivedFields(self, account: Optional[models.Account] = None):
+        """Every balance of the account stores the days and APR since its previous check"""
+        for balance in models.Balance.objects.filter(account=account or self.account).order_by('timestamp'):
+            previous = balance.previous_check
+            with self.subTest(timestamp=balance.timestamp):
+                self.assertEqual(balance.days_since_last_check, balance.days_after(previous))
+                expected = balance.APR_after(previous)
+                if expected is None:
+                    self.assertIsNone(balance.APR)
+                else:
+                    self.assertAlmostEqual(float(balance.APR), float(expected), places=4)
+
+
+@override_settings(INGEST_TOKEN='secret')
+class IngestTests(DerivedFieldsTestCase):
+    def ingest(self, items, client: Optional[Client] = None, content_type: str = 'application/json', **headers):
+        return (client or self.client).post('/ingest', json.dumps(items), content_type=content_type,
+                                             **{'HTTP_AUTHORIZATION': 'Bearer secret', **headers})
+
+    def test_statuses(self):
+        self.check(1, '1000')
+        self.check(11, '1010')
+        response = self.ingest([
+            {"account": self.account.pk, "timestamp": "2022-01-06", "balance": "1005"},
+            {"account": self.account.pk, "timestamp": "2022-01-11", "balance": "1020"},
+            {"account": self.account.pk, "timestamp": "2022-01-01", "balance": "1000"},
+            {"account": 999, "timestamp": "2022-01-02", "balance": "1"},
+            {"account": self.account.pk, "timestamp": "2022-01-06", "balance": "1006"},
+            {"account": self.account.pk, "timestamp": "not a date", "balance": "1"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        statuses = response.json()
+        self.assertEqual([status["status"] for status in statuses],
+                         ["created", "updated", "unchanged", "invalid", "invalid", "invalid"])
+        self.assertIn("account", statuses[3]["errors"])
+        self.assertIn("timestamp", statuses[4]["errors"])
+        self.assertIn("timestamp", statuses[5]["errors"])
+        self.assertEqual(models.Balance.objects.get(pk=statuses[1]["id"]).balance, Decimal('1020'))
+        self.assertEqual(models.Balance.objects.filter(account=self.account).count(), 3)
+        self.assertDerivedFields()
+
+    def test_update_refreshes_following_balance(self):
+        self.check(1, '1000')
+        self.check(11, '1010')
+        self.check(21, '1030')
+        response = self.ingest([{"account": self.account.pk, "timestamp": "2022-01-11", "balance": "1001"}])
+        self.assertEqual(response.json()[0]["status"], "updated")
+        following = models.Balance.objects.get(account=self.account, timestamp=datetime.date(2022, 1, 21))
+        self.assertEqual(following.days_since_last_check, 10)
+        self.assertAlmostEqual(float(following.APR), (1030 / 1001 - 1) / 10 * 365, places=4)
+        self.assertDerivedFields()
+
+    def test_requires_token(self):
+        response = self.ingest([], HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post('/ingest', '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_session_requires_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        item = [{"account": self.account.pk, "timestamp": "2022-01-01", "balance": "1000"}]
+        response = client.post('/ingest', json.dumps(item), content_type='text/plain')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(models.Balance.objects.exists())
+        self.assertEqual(self.ingest(item, client).status_code, 200)
+
+    def test_requires_json(self):
+        response = self.ingest([{"account": self.account.pk, "timestamp": "2022-01-01", "balance": "1"}],
+                               content_type='text/plain')
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(models.Balance.objects.exists())
+
+
+@override_settings(QUERY_WORKERS=1)
+class QueryCacheTests(DerivedFieldsTestCase):
+    payload = json.dumps({
+        "range": {"from": "2022-01-01T00:00:00Z", "to": "2022-01-31T00:00:00Z"},
+        "targets": [{"target": "balances"}],
+    })
+
+    def setUp(self):
+        super().setUp()
+        query_cache.clear()
+        self.check(1, '1000')
+
+    def query(self):
+        response = self.client.post('/query', self.payload, content_type='application/json')
+        return response["X-Cache"], response["ETag"], len(json.loads(response.content)[0]["datapoints"])
+
+    def test_import_invalidates_responses(self):
+        _, etag, _ = self.query()
+        self.assertEqual(self.query(), ("HIT", etag, 1))
+        importers.BalanceImporter().run([importers.Record(self.account.pk, datetime.date(2022, 1, 11), Decimal(1010))])
+        cache, new_etag, points = self.query()
+        self.assertEqual((cache, points), ("MISS", 2))
+        self.assertNotEqual(new_etag, etag)
+
+    def test_queryset_delete_invalidates_accounts_once(self):
+        self.check(11, '1010')
+        self.check(21, '1020')
+        self.query()
+        with CaptureQueriesContext(connection) as queries:
+            models.Balance.objects.filter(timestamp__gt=datetime.date(2022, 1, 1)).delete()
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "savings_account"')]), 1)
+        self.assertEqual(self.query()[::2], ("MISS", 1))
+
+    def test_versions_are_read_from_the_database(self):
+        # As written by another process, whose signals only reach the database
+        self.query()
+        models.Account.objects.update(data_version=models.new_version())
+        self.assertEqual(self.query()[0], "MISS")
+
+
+@override_settings(QUERY_WORKERS=1)
+class QueryValidationTests(DerivedFieldsTestCase):
+    def query(self, **options):
+        payload = {
+            "range": {"from": "2022-01-01T00:00:00Z", "to": "2022-01-31T00:00:00Z"},
+            "targets": [{"target": "accounts", "data": options}],
+        }
+        return self.client.post('/query', json.dumps(payload), content_type='application/json')
+
+    def test_recent_days(self):
+        for days in [0, 30, '30']:
+            with self.subTest(days=days):
+                self.assertEqual(self.query(days=days).status_code, 200)
+
+    def test_invalid_recent_days(self):
+        for days in ['month', None, [30], -1, 10 ** 10]:
+            with self.subTest(days=days):
+                response = self.query(days=days)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", json.loads(response.content))
+
+
+@override_settings(QUERY_WORKERS=1, PROFILE_TOKEN='secret')
+class ProfileTests(DerivedFieldsTestCase):
+    payload = QueryCacheTests.payload
+
+    def setUp(self):
+        super().setUp()
+        self.check(1, '1000')
+
+    def query(self, profile: str, **headers):
+        return self.client.post(f'/query?profile={profile}', self.payload, content_type='application/json', **headers)
+
+    def test_profile_modes(self):
+        for profile, explain in [('1', False), ('true', False), ('explain', True)]:
+            with self.subTest(profile=profile):
+                response = self.query(profile, HTTP_AUTHORIZATION='Bearer secret')
+                self.assertEqual(response.status_code, 200)
+                targets = json.loads(response.content)["profile"]["targets"]
+                self.assertTrue(targets)
+                self.assertEqual(any("plan" in query for target in targets for query in target["queries"]), explain)
+
+    def test_other_values_do_not_profile(self):
+        for profile in ['0', 'false', 'no']:
+            with self.subTest(profile=profile):
+                response = self.query(profile)
+                self.assertEqual(response.status_code, 200)
+                self.assertIsInstance(json.loads(response.content), list)
+
+    def test_requires_token(self):
+        self.assertEqual(self.query('1').status_code, 403)
+
+
+class ImporterTests(DerivedFieldsTestCase):
+    def run_import(self, *checks):
+        importer = importers.BalanceImporter(batch_size=2).run(
+            importers.Record(self.account.pk, datetime.date(2022, 1, day), Decimal(balance)) for day, balance in checks
+        )
+        self.assertDerivedFields()
+        return importer
+
+    def test_in_order(self):
+        self.run_import((10, 1000), (19, 1300), (20, 1000))
+        self.assertEqual(models.Balance.objects.get(timestamp=datetime.date(2022, 1, 19)).days_since_last_check, 9)
+
+    def test_out_of_order(self):
+        self.run_import((10, 1000), (20, 1000), (19, 1300))
+        self.assertEqual(models.Balance.objects.get(timestamp=datetime.date(2022, 1, 20)).days_since_last_check, 1)
+
+    def test_between_stored_checks(self):
+        self.check(1, '1000')
+        self.check(31, '1030')
+        importer = self.run_import((16, 1010), (1, 999), (31, 1))
+        self.assertEqual((importer.created, importer.skipped), (1, 2))
+
+
+class SeriesStoreTests(DerivedFieldsTestCase):
+    def points(self, store: SeriesStore) -> dict:
+        return {series["target"]: len(series["datapoints"]) for series in store.series('balance')}
+
+    def test_reloads_accounts_written_by_other_processes(self):
+        self.check(1, '1000')
+        store = SeriesStore()
+        self.assertEqual(self.points(store), {"Bank - Saver": 1})
+        # Another process writes balances and replaces the data version, without this process's signals
+        models.Balance.objects.bulk_create([models.Balance(account=self.account, timestamp=datetime.date(2022, 1, 2),
+                                                           balance=Decimal(1001))])
+        self.assertEqual(self.points(store), {"Bank - Saver": 1})
+        models.Account.objects.filter(pk=self.account.pk).update(data_version=models.new_version())
+        self.assertEqual(self.points(store), {"Bank - Saver": 2})
+
+    def test_drops_deleted_accounts(self):
+        other = models.Account.objects.create(bank_name='Other', account_name='Saver',
+                                              predicted_interest=Decimal('0.01'), instant_withdrawal=False)
+        self.check(1, '1000', account=other)
+        store = SeriesStore()
+        self.assertEqual(self.points(store), {"Bank - Saver": 0, "Other - Saver": 1})
+        other.delete()
+        self.assertEqual(self.points(store), {"Bank - Saver": 0})
+
+    def test_reloads_account_a_balance_moved_from(self):
+        other = models.Account.objects.create(bank_name='Other', account_name='Saver',
+                                              predicted_interest=Decimal('0.01'), instant_withdrawal=False)
+        moved = self.check(1, '1000')
+        self.check(11, '1010')
+        self.check(21, '1020')
+        store = SeriesStore()
+        self.assertEqual(self.points(store), {"Bank - Saver": 3, "Other - Saver": 0})
+        moved.account = other
+        moved.save()
+        self.assertEqual(self.points(store), {"Bank - Saver": 2, "Other - Saver": 1})
+
+
+class NeighbourTests(DerivedFieldsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checks = [self.check(1, '1000'), self.check(11, '1010'), self.check(21, '1030', topup='10')]
+
+    def test_append(self):
+        self.assertDerivedFields()
+
+    def test_insert_in_the_middle(self):
+        self.check(6, '1002')
+        self.check(16, '1020')
+        self.assertDerivedFields()
+
+    def test_edit(self):
+        middle = self.checks[1]
+        middle.balance = Decimal('1005')
+        middle.topup = Decimal('5')
+        middle.save()
+        self.assertDerivedFields()
+
+    def test_move_across_another_check(self):
+        first = self.checks[0]
+        first.timestamp = datetime.date(2022, 1, 16)
+        first.save()
+        self.assertDerivedFields()
+        last = self.checks[2]
+        last.timestamp = datetime.date(2021, 12, 25)
+        last.save()
+        self.assertDerivedFields()
+
+    def test_move_to_another_account(self):
+        other = models.Account.objects.create(bank_name='Other', account_name='Saver',
+                                              predicted_interest=Decimal('0.01'), instant_withdrawal=False)
+        self.check(5, '500', account=other)
+        self.check(15, '510', account=other)
+        middle = self.checks[1]
+        middle.account = other
+        middle.save()
+        self.assertDerivedFields()
+        self.assertDerivedFields(other)
+
+    def test_delete(self):
+        self.checks[1].delete()
+        self.assertDerivedFields()
+
+    def test_account_delete(self):
+        other = models.Account.objects.create(bank_name='Other', account_name='Saver',
+                                              predicted_interest=Decimal('0.01'), instant_withdrawal=False)
+        for day in range(22, 32):
+            self.check(day, '1040')
+            self.check(day, '500', account=other)
+        account = models.Account.objects.get(pk=self.account.pk)
+        # Loading the balances, then deleting them and the account, however many there are
+        with self.assertNumQueries(3):
+            account.delete()
+        with self.assertNumQueries(5):
+            models.Account.objects.filter(pk=other.pk).delete()
+
+    def test_queryset_delete(self):
+        self.check(26, '1040')
+        models.Balance.objects.filter(timestamp__in=[datetime.date(2022, 1, 11), datetime.date(2022, 1, 21)]).delete()
+        self.assertDerivedFields()
+        self.assertEqual(models.Balance.objects.get(timestamp=datetime.date(2022, 1, 26)).days_since_last_check, 25)
+
+
+class HistoryQueryTests(DerivedFieldsTestCase):
+    """The window function queries of `BalanceQuerySet` give the same values as the per-balance properties"""
+
+    def setUp(self):
+        super().setUp()
+        self.other = models.Account.objects.create(bank_name='Other', account_name='Saver',
+                                                   predicted_interest=Decimal('0.01'), instant_withdrawal=False)
+        checks = [
+            (self.account, datetime.date(2021, 12, 20), '990', '0'),
+            (self.account, datetime.date(2022, 1, 3), '1000', '0'),
+            (self.account, datetime.date(2022, 1, 12), '1012', '10'),
+            (self.account, datetime.date(2022, 1, 30), '1015', '0'),
+            (self.account, datetime.date(2022, 2, 14), '1120', '100'),
+            (self.other, datetime.date(2022, 1, 5), '500', '0'),
+            (self.other, datetime.date(2022, 1, 19), '502', '0'),
+            (self.other, datetime.date(2022, 2, 2), '498', '-5'),
+        ]
+        for account, timestamp, balance, topup in checks:
+            models.Balance(account=account, timestamp=timestamp, balance=Decimal(balance), topup=Decimal(topup)).save()
+
+    def assertMatchesProperties(self, rows):
+        for row in rows:
+            previous = row.previous_check
+            with self.subTest(account=row.account_id, timestamp=row.timestamp):
+                self.assertEqual(row.previous_timestamp, previous and previous.timestamp)
+                self.assertEqual(row.previous_balance, previous and previous.balance)
+                self.assertEqual(row.days_elapsed, row.days_after(previous))
+                self.assertEqual(row.period_returns, row.returns)
+                expected = row.APR_after(previous)
+                if expected is None:
+                    self.assertIsNone(row.period_APR)
+                else:
+                    self.assertAlmostEqual(float(row.period_APR), float(expected), places=4)
+
+    def test_with_history(self):
+        self.assertMatchesProperties(models.Balance.objects.with_history())
+
+    def test_with_history_of_a_range(self):
+        rows = models.Balance.objects.between(datetime.date(2022, 1, 10), datetime.date(2022, 1, 31)).with_history()
+        self.assertEqual(
+            sorted((row.account_id, row.timestamp.day) for row in rows),
+            # The last check of each account before the range leads in
+            sorted([(self.account.pk, 3), (self.account.pk, 12), (self.account.pk, 30),
+                    (self.other.pk, 5), (self.other.pk, 19)]),
+        )
+        self.assertMatchesProperties(row for row in rows if row.timestamp >= datetime.date(2022, 1, 10))
+
+    def expected_buckets(self, kind: str, start: datetime.date) -> list:
+        """Buckets computed from the properties of each balance in them"""
+        first_day = models.BUCKETS[kind][1]
+        grouped = {}
+        for balance in models.Balance.objects.filter(timestamp__gte=first_day(start)).order_by('account', 'timestamp'):
+            grouped.setdefault((balance.account_id, first_day(balance.timestamp)), []).append(balance)
+        expected = []
+        for (account_id, bucket), balances in grouped.items():
+            rated = [(balance.APR_after(balance.previous_check), balance.days_since_last_check) for balance in balances]
+            rated = [(APR, days) for APR, days in rated if APR is not None]
+            returns = [balance.returns for balance in balances if balance.returns is not None]
+            expected.append((
+                account_id, bucket, balances[-1].balance,
+                sum(APR * days for APR, days in rated) / sum(days for _, days in rated) if rated else None,
+                sum(returns) if returns else None,
+            ))
+        return expected
+
+    def test_buckets(self):
+        for kind in ['day', 'week', 'month']:
+            for start in [datetime.date(2021, 1, 1), datetime.date(2022, 1, 14)]:
+                with self.subTest(kind=kind, start=start):
+                    buckets = list(models.Balance.objects.buckets(kind, start))
+                    expected = self.expected_buckets(kind, start)
+                    self.assertEqual([bucket[:3] for bucket in buckets], [bucket[:3] for bucket in expected])
+                    for (*_, APR, returns), (*_, expected_APR, expected_returns) in zip(buckets, expected):
+                        self.assertEqual(APR is None, expected_APR is None)
+                        if APR is not None:
+                            self.assertAlmostEqual(float(APR), float(expected_APR), places=4)
+                        self.assertEqual(returns, expected_returns)
+
+    def test_recompute(self):
+        models.Balance.objects.update(days_since_last_check=None, APR=None)
+        self.assertEqual(models.Balance.objects.recompute(), 8)
+        self.assertDerivedFields()
+        self.assertDerivedFields(self.other)
+
+    def test_recompute_since(self):
+        since = datetime.date(2022, 1, 10)
+        models.Balance.objects.update(days_since_last_check=None, APR=None)
+        self.assertEqual(models.Balance.objects.recompute(since), 5)
+        self.assertFalse(models.Balance.objects.filter(timestamp__lt=since, days_since_last_check__isnull=False).exists())
+        models.Balance.objects.filter(timestamp__lt=since).recompute()
+        self.assertDerivedFields()
+        self.assertDerivedFields(self.other)
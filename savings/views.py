@@ -1,10 +1,35 @@
 import datetime
+import functools
+import hashlib
+import itertools
 import json
+import math
+from collections import defaultdict
+from typing import Callable, Dict, Iterator, Optional, Tuple
 
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
 
-from . import models
+from . import importers, metrics, models
+from .annotations import KINDS as ANNOTATION_KINDS, limit_crossings, topups
+from .cache import query_cache
+from .concurrency import run_concurrently
+from .encoding import dumps
+from .loader import QueryLoader, number
+from .portfolio import GROUPS as PORTFOLIO_GROUPS, VALUES as PORTFOLIO_VALUES, portfolio
+from .profiling import Profiler
+from .projection import RATES, projections
+from .routers import read_only
+from .snapshot import snapshot
+from .store import series_store
 
 ACCOUNT_DEF = [
     {"text": "Starting Balance",    "type": "number"},
@@ -22,7 +47,63 @@ ACCOUNT_DEF = [
     {"text": "Interest Min",        "type": "number"},
     {"text": "Interest Max",        "type": "number"},
     {"text": "Instant Withdrawal",  "type": "bool"},
+    {"text": "Recent APR",          "type": "number"},
 ]
+RECENT_APR_DAYS = 90
+SERIES_TARGETS = {
+    "balances": "balance",
+    "APRs":     "APR",
+    "returns":  "returns",
+}
+
+
+def time_range(data: dict) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
+    """Dates covered by the `range` of a Grafana query, either end may be open"""
+    requested = data.get("range") or {}
+    start = parse_datetime(requested["from"]) if requested.get("from") else None
+    end = parse_datetime(requested["to"]) if requested.get("to") else None
+    return start.date() if start else None, end.date() if end else None
+
+
+def series_bucket(data: dict, target: dict) -> Optional[str]:
+    """Calendar bucket a series target is aggregated by, from its `bucket` or the interval between panel points
+
+    Intervals under a week show the individual balances, which are at most daily.
+    """
+    options = target.get("data") or {}
+    if "bucket" in options:
+        return options["bucket"] if options["bucket"] in models.BUCKETS else None
+    interval = datetime.timedelta(milliseconds=data.get("intervalMs") or 0)
+    if interval >= datetime.timedelta(days=28):
+        return "month"
+    if interval >= datetime.timedelta(days=7):
+        return "week"
+    return None
+
+
+def max_datapoints(data: dict) -> Optional[int]:
+    """Number of points a Grafana panel can display, taking both `maxDataPoints` and `intervalMs` into account"""
+    limit = data.get("maxDataPoints")
+    requested = data.get("range") or {}
+    if data.get("intervalMs") and requested.get("from") and requested.get("to"):
+        span = parse_datetime(requested["to"]) - parse_datetime(requested["from"])
+        intervals = math.ceil(span.total_seconds() * 1000 / data["intervalMs"])
+        limit = min(limit, intervals) if limit else intervals
+    return int(limit) if limit else None
+
+
+def conditional(request, fingerprint: str, render: Callable[[], HttpResponse]) -> HttpResponse:
+    """Tag the response with an ETag, answering 304 Not Modified without rendering it if the client already has it
+
+    Grafana POSTs its queries, so unlike `django.views.decorators.http.condition` this applies to every method.
+    """
+    etag = quote_etag(fingerprint)
+    if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = render()
+    response["ETag"] = etag
+    return response
 
 
 # Create your views here.
@@ -33,100 +114,386 @@ def test(request):
 
 
 @csrf_exempt
+@read_only
 def search(request):
     """Used by Grafana to find metrics"""
-    return JsonResponse(["accounts", "balances", "APRs", "returns"], safe=False)
+    content = json.dumps(["accounts", "balances", "APRs", "returns", "projection", "portfolio"]).encode()
+    return conditional(request, hashlib.sha1(content).hexdigest(),
+                       lambda: HttpResponse(content, content_type="application/json"))
+
+
+def account_filters(data: dict, target: dict) -> Tuple[models.AccountFilter, ...]:
+    """Ad-hoc filters of the dashboard, and the account fields given in the target's data, for `filtered`"""
+    filters = [
+        (str(adhoc.get("key")), adhoc.get("operator") or "=", str(adhoc.get("value", "")))
+        for adhoc in data.get("adhocFilters") or ()
+    ]
+    options = target.get("data") or {}
+    filters += [(key, "=", str(options[key])) for key in ("pk", *models.TAG_KEYS) if key in options]
+    return tuple(sorted(filters))
+
+
+def recent_days(target: dict) -> int:
+    """Days the recent APR of an accounts table is averaged over, the target's `days` or `RECENT_APR_DAYS`
+
+    Raises `ValidationError` unless it is a whole number of days, zero or more.
+    """
+    days = (target.get("data") or {}).get("days", RECENT_APR_DAYS)
+    try:
+        days = int(days)
+        datetime.date.today() - datetime.timedelta(days=days)
+    except (TypeError, ValueError, OverflowError):
+        raise ValidationError(f"Invalid number of days: {days}")
+    if days < 0:
+        raise ValidationError(f"Invalid number of days: {days}")
+    return days
+
+
+def series_loaders(data: dict) -> Dict[int, QueryLoader]:
+    """Loader of each series target, shared by the targets with the same filters"""
+    shared = {}
+    loaders = {}
+    for index, target in enumerate(data["targets"]):
+        if target["target"] in SERIES_TARGETS:
+            filters = account_filters(data, target)
+            if filters not in shared:
+                shared[filters] = QueryLoader(*time_range(data), filters=filters,
+                                              store=series_store if settings.SERIES_STORE else None)
+            loaders[index] = shared[filters]
+    return loaders
+
+
+def request_key(data: dict) -> tuple:
+    """Normalized form of a Grafana query, covering everything its response depends on
+
+    Grafana moves the range on every refresh, so only the dates and the number of points it resolves to are kept.
+    """
+    return (
+        datetime.date.today(),
+        time_range(data),
+        max_datapoints(data),
+        tuple(
+            (target["target"], json.dumps(target.get("data"), sort_keys=True), series_bucket(data, target),
+             account_filters(data, target))
+            for target in data["targets"]
+        ),
+    )
+
+
+def accounts_table(data: dict, target: dict) -> dict:
+    """Grafana table of the accounts matching the filters, such as the account given by the target's `pk`"""
+    accounts = models.Account.objects.filtered(account_filters(data, target)).with_summary(
+        recent_days=recent_days(target)
+    )
+    return {
+        "columns": ACCOUNT_DEF,
+        "rows":
+            [[
+                number(account.summary_starting_balance),
+                number(account.summary_current_balance),
+                number(account.summary_total_topup),
+                number(account.summary_average_APR),
+                number(account.summary_returns),
+                account.summary_balance_OK,
+                account.__str__(),
+                account.bank_name,
+                account.account_name,
+                account.account_number,
+                account.sort_code,
+                number(account.predicted_interest),
+                number(account.interest_min),
+                number(account.interest_max),
+                account.instant_withdrawal,
+                number(account.summary_recent_APR),
+            ] for account in accounts],
+        "type": "table"
+    }
+
+
+def projection(data: dict, target: dict) -> list:
+    """Projected balance of every account over the queried range, at the rate and granularity given by the target"""
+    options = target.get("data") or {}
+    start, end = time_range(data)
+    today = datetime.date.today()
+    return projections(
+        start or today, end or today + datetime.timedelta(days=365),
+        kind=series_bucket(data, target) or "day",
+        rate=options["rate"] if options.get("rate") in RATES else "predicted",
+        limit=max_datapoints(data),
+        filters=account_filters(data, target),
+    )
+
+
+def portfolio_totals(data: dict, target: dict) -> list:
+    """Total balance, topups or returns over every account, or per bank, as given by the target"""
+    options = target.get("data") or {}
+    return portfolio(
+        *time_range(data),
+        value=options["value"] if options.get("value") in PORTFOLIO_VALUES else "balance",
+        group_by=options["group_by"] if options.get("group_by") in PORTFOLIO_GROUPS else None,
+        limit=max_datapoints(data),
+        filters=account_filters(data, target),
+    )
+
+
+def render_query(data: dict, measure: Callable = metrics.measured) -> list:
+    """Build the response to a Grafana query
+
+    Accounts tables, projections, portfolio totals and the balance snapshot shared by the series targets are
+    independent queries, and are run concurrently, so the request waits for the slowest of them rather than all of
+    them in turn. Each target is evaluated through `measure`, with its name.
+    """
+    loaders = series_loaders(data)
+    limit = max_datapoints(data)
+    tasks = {}
+    for index, target in enumerate(data["targets"]):
+        if target["target"] == "accounts":
+            tasks[index] = functools.partial(accounts_table, data, target)
+        elif target["target"] == "projection":
+            tasks[index] = functools.partial(projection, data, target)
+        elif target["target"] == "portfolio":
+            tasks[index] = functools.partial(portfolio_totals, data, target)
+    buckets = defaultdict(set)
+    for index, loader in loaders.items():
+        buckets[loader].add(series_bucket(data, data["targets"][index]))
+    prefetch = [task for loader, kinds in buckets.items() for task in loader.prefetch(kinds)]
+    results = dict(zip(tasks, run_concurrently([
+        *(functools.partial(measure, data["targets"][index]["target"], task) for index, task in tasks.items()),
+        *(functools.partial(measure, "snapshot", task) for task in prefetch),
+    ])))
+
+    response = []
+    for index, target in enumerate(data["targets"]):
+        if target["target"] == "accounts":
+            response.append(results[index])
+        elif target["target"] in ("projection", "portfolio"):
+            response += results[index]
+        elif target["target"] in SERIES_TARGETS:
+            response += measure(target["target"], functools.partial(
+                loaders[index].series, SERIES_TARGETS[target["target"]], limit, series_bucket(data, target)
+            ))
+    return response
+
+
+def stream_query(data: dict, chunk_size: int = 1000) -> Iterator[bytes]:
+    """Like `render_query`, but encoding series as they are read from the database, `chunk_size` points at a time"""
+    loaders = series_loaders(data)
+    limit = max_datapoints(data)
+    separator = b"["
+    for index, target in enumerate(data["targets"]):
+        loader = loaders.get(index)
+        if target["target"] == "accounts":
+            yield separator + dumps(accounts_table(data, target))
+            separator = b","
+        elif target["target"] in ("projection", "portfolio"):
+            render = projection if target["target"] == "projection" else portfolio_totals
+            for series in render(data, target):
+                yield separator + dumps(series)
+                separator = b","
+        elif target["target"] in SERIES_TARGETS and (series_bucket(data, target) or loader.store is not None):
+            # Aggregated series are small enough to encode whole, and stored ones are already in memory
+            for series in loader.series(SERIES_TARGETS[target["target"]], limit, series_bucket(data, target)):
+                yield separator + dumps(series)
+                separator = b","
+        elif target["target"] in SERIES_TARGETS:
+            for account, datapoints in loader.iter_series(SERIES_TARGETS[target["target"]], limit):
+                yield separator + b'{"target":' + dumps(str(account)) + b',"datapoints":['
+                separator = b","
+                points = b""
+                while True:
+                    chunk = list(itertools.islice(datapoints, chunk_size))
+                    if not chunk:
+                        break
+                    yield points + dumps(chunk)[1:-1]
+                    points = b","
+                yield b"]}"
+    yield b"]" if separator == b"," else b"[]"
 
 
 @csrf_exempt
+@read_only
 def query(request):
-    response = []
     data = json.loads(request.body)
-    for target in data["targets"]:
-        if target["target"] == "accounts":
-            if "data" in target and target["data"] is not None and "pk" in target["data"]:
-                account = models.Account.objects.get(pk=target["data"]["pk"])
-                response.append({
-                    "columns": ACCOUNT_DEF,
-                    "rows": [
-                        [
-                            float(account.starting_balance.balance) if account.starting_balance else None,
-                            float(account.current_balance.balance) if account.current_balance else None,
-                            float(account.total_topup),
-                            float(account.average_APR),
-                            float(account.returns),
-                            account.balance_OK,
-                            account.__str__(),
-                            account.bank_name,
-                            account.account_name,
-                            account.account_number,
-                            account.sort_code,
-                            float(account.predicted_interest),
-                            float(account.interest_min) if account.interest_min else None,
-                            float(account.interest_max) if account.interest_max else None,
-                            account.instant_withdrawal
-                        ],
-                    ],
-                    "type": "table"
-                })
-            else:
-                accounts = models.Account.objects.all()
-                response.append({
-                    "columns": ACCOUNT_DEF,
-                    "rows":
-                        [[
-                            float(account.starting_balance.balance) if account.starting_balance else None,
-                            float(account.current_balance.balance) if account.current_balance else None,
-                            float(account.total_topup) if account.total_topup else None,
-                            float(account.average_APR) if account.average_APR else None,
-                            float(account.returns) if account.returns else None,
-                            account.balance_OK,
-                            account.__str__(),
-                            account.bank_name,
-                            account.account_name,
-                            account.account_number,
-                            account.sort_code,
-                            float(account.predicted_interest) if account.predicted_interest else None,
-                            float(account.interest_min) if account.interest_min else None,
-                            float(account.interest_max) if account.interest_max else None,
-                            account.instant_withdrawal
-                        ] for account in accounts],
-                    "type": "table"
-                })
-        elif target["target"] == "balances":
-            for account in models.Account.objects.all():
-                response.append({
-                    "target": str(account),
-                    "datapoints": sorted([
-                        [
-                            float(balance.balance),
-                            int(datetime.datetime.combine(balance.timestamp, datetime.datetime.min.time()).timestamp()*1000)
-                        ] for balance in account.balance_set.all()], key=lambda tup: tup[1])
-                })
-        elif target["target"] == "APRs":
-            for account in models.Account.objects.all():
-                response.append({
-                    "target": str(account),
-                    "datapoints": sorted([
-                        [
-                            float(balance.APR) if balance.APR else None,
-                            int(datetime.datetime.combine(balance.timestamp, datetime.datetime.min.time()).timestamp()*1000)
-                        ] for balance in account.balance_set.all()], key=lambda tup: tup[1])
-                })
-        elif target["target"] == "returns":
-            for account in models.Account.objects.all():
-                response.append({
-                    "target": str(account),
-                    "datapoints": sorted([
-                        [
-                            float(balance.returns) if balance.returns else None,
-                            int(datetime.datetime.combine(balance.timestamp, datetime.datetime.min.time()).timestamp()*1000)
-                        ] for balance in account.balance_set.all()], key=lambda tup: tup[1])
-                })
-
-    return JsonResponse(response, safe=False)
+    try:
+        for target in data["targets"]:
+            models.Account.objects.filtered(account_filters(data, target))
+            if target["target"] == "accounts":
+                recent_days(target)
+    except ValidationError as error:
+        return JsonResponse({"error": error.messages}, status=400)
+
+    mode = profile_mode(request)
+    if mode is not None:
+        # Profiled queries are always evaluated, bypassing the response cache
+        if not can_profile(request):
+            return JsonResponse({"error": "Not allowed to profile queries"}, status=403)
+        profiler = Profiler(explain=mode == "explain")
+        results = render_query(data, profiler.measured)
+        return HttpResponse(dumps({"results": results, "profile": profiler.summary()}), content_type="application/json")
+
+    fingerprint = query_cache.fingerprint(request_key(data))
+    if request.GET.get("stream"):
+        # Large responses are sent as they are encoded, and not kept in the response cache
+        return conditional(request, fingerprint, lambda: StreamingHttpResponse(
+            stream_query(data), content_type="application/json"
+        ))
+
+    def render():
+        content, hit = query_cache.get_or_set(
+            fingerprint, lambda: dumps(render_query(data))
+        )
+        response = HttpResponse(content, content_type="application/json")
+        response["X-Cache"] = "HIT" if hit else "MISS"
+        return response
+
+    return conditional(request, fingerprint, render)
+
+
+@csrf_exempt
+@read_only
+def tag_keys(request):
+    """Used by Grafana to list the keys of ad-hoc filters"""
+    return JsonResponse([{"type": kind, "text": key} for key, kind in models.TAG_KEYS.items()], safe=False)
+
+
+@csrf_exempt
+@read_only
+def tag_values(request):
+    """Used by Grafana to list the values of an ad-hoc filter key"""
+    try:
+        key = json.loads(request.body).get("key")
+    except (ValueError, AttributeError):
+        key = None
+    if key not in models.TAG_KEYS:
+        return JsonResponse({"error": "Expected one of the tag keys"}, status=400)
+    values = models.Account.objects.order_by(key).values_list(key, flat=True).distinct()
+    return JsonResponse([
+        {"text": str(value).lower() if isinstance(value, bool) else value} for value in values
+    ], safe=False)
+
+
+def prometheus(request):
+    """Request, Grafana target, SQL and response cache metrics of this process, in the Prometheus text format"""
+    return HttpResponse(metrics.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@csrf_exempt
+def cache(request):
+    """Hit rate of the /query response cache, and memory held by the series store, in this process"""
+    stats = query_cache.stats()
+    if settings.SERIES_STORE:
+        stats["series_store"] = series_store.stats()
+    return JsonResponse(stats)
+
+
+def health(request):
+    """Whether every database answers, for container and load balancer health checks"""
+    databases = {}
+    for alias in connections:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT 1")
+            databases[alias] = "ok"
+        except DatabaseError as error:
+            databases[alias] = str(error)
+    response = {"databases": databases}
+    if snapshot is not None:
+        response["snapshot_age"] = snapshot.age()
+    healthy = all(status == "ok" for status in databases.values())
+    return JsonResponse(response, status=200 if healthy else 503)
+
+
+def has_bearer_token(request, expected: Optional[str]) -> bool:
+    scheme, _, token = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    return bool(expected) and scheme.lower() == "bearer" and constant_time_compare(token.strip(), expected)
+
+
+def can_ingest(request) -> bool:
+    """Whether the request may write balances, through a session or the `INGEST_TOKEN` bearer token"""
+    if request.user.has_perm("savings.add_balance") and request.user.has_perm("savings.change_balance"):
+        return True
+    return has_bearer_token(request, settings.INGEST_TOKEN)
+
+
+def profile_mode(request) -> Optional[str]:
+    """`"profile"` or `"explain"` when `?profile=` or the X-Profile header is `1`, `true` or `explain`, otherwise None"""
+    value = (request.GET.get("profile") or request.META.get("HTTP_X_PROFILE") or "").lower()
+    if value in ("1", "true"):
+        return "profile"
+    return "explain" if value == "explain" else None
+
+
+def can_profile(request) -> bool:
+    """Whether the request may profile queries, through a staff session or the `PROFILE_TOKEN` bearer token"""
+    return request.user.is_staff or has_bearer_token(request, settings.PROFILE_TOKEN)
+
+
+def record_balances(request):
+    if not can_ingest(request):
+        return JsonResponse({"error": "Not allowed to record balances"}, status=403)
+    if request.content_type != "application/json":
+        return JsonResponse({"error": "Expected an application/json body"}, status=415)
+    try:
+        items = json.loads(request.body)
+    except ValueError:
+        items = None
+    if not isinstance(items, list):
+        return JsonResponse({"error": "Expected a JSON array of balances"}, status=400)
+    return JsonResponse(importers.upsert(items), safe=False, encoder=DjangoJSONEncoder)
 
 
 @csrf_exempt
+@require_POST
+def ingest(request):
+    """Used by scrapers to create or update many balances at once, answering with the status of each record
+
+    Only requests with the `INGEST_TOKEN` bearer token skip the CSRF check, as a browser adds the session cookie to
+    cross-site requests but never the token.
+    """
+    if has_bearer_token(request, settings.INGEST_TOKEN):
+        return record_balances(request)
+    return csrf_protect(record_balances)(request)
+
+
+def annotation_options(data: dict) -> dict:
+    """Options of a Grafana annotation query, either a JSON object or just the kind of events to show"""
+    query = ((data.get("annotation") or {}).get("query") or "").strip()
+    if query.startswith("{"):
+        options = json.loads(query)
+        return options if isinstance(options, dict) else {}
+    return {"kind": query}
+
+
+@csrf_exempt
+@read_only
 def annotations(request):
-    return JsonResponse([], safe=False)
+    """Used by Grafana to overlay topups, withdrawals and interest limit crossings of the accounts matching the query"""
+    try:
+        data = json.loads(request.body)
+        options = annotation_options(data)
+        filters = account_filters(data, {"data": options})
+        models.Account.objects.filtered(filters)
+    except ValueError:
+        return JsonResponse({"error": "Expected a JSON annotation query"}, status=400)
+    except ValidationError as error:
+        return JsonResponse({"error": error.messages}, status=400)
+    kinds = [options["kind"]] if options.get("kind") in ANNOTATION_KINDS else ANNOTATION_KINDS
+    start, end = time_range(data)
+    annotation = data.get("annotation") or {}
+    fingerprint = query_cache.fingerprint((
+        "annotations", datetime.date.today(), (start, end), filters, tuple(kinds),
+        json.dumps(annotation, sort_keys=True),
+    ))
+
+    def render_annotations() -> bytes:
+        events = []
+        if "topups" in kinds:
+            events += topups(start, end, filters)
+        if "limits" in kinds:
+            events += limit_crossings(start, end, filters)
+        events.sort(key=lambda event: event["time"])
+        return dumps([dict(event, annotation=annotation) for event in events])
+
+    return conditional(request, fingerprint, lambda: HttpResponse(
+        query_cache.get_or_set(fingerprint, render_annotations)[0], content_type="application/json"
+    ))
@@ -11,9 +11,26 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import pathlib
 
 CURRENCY_FORMAT = os.environ.get("CURRENCY_FORMAT")
 
+# Bearer token allowing scrapers to record balances through /ingest
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN")
+
+# Bearer token allowing /query?profile=1 (or =explain) to profile queries, besides staff sessions
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+
+# Directory profiles of queries are also written to as pstats files
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+
+# Threads shared by all requests to evaluate the targets of a Grafana query concurrently, 1 to evaluate them in turn.
+# Each keeps its own database connection, and benchmark_query shows no gain on SQLite
+QUERY_WORKERS = int(os.environ.get("QUERY_WORKERS", 1))
+
+# Keep every series in memory in each process, answering /query ranges without querying balances
+SERIES_STORE = bool(int(os.environ.get("SERIES_STORE", 0)))
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -47,6 +64,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'savings.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,7 +114,54 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD", "password"),
         "HOST": os.environ.get("SQL_HOST", "localhost"),
         "PORT": os.environ.get("SQL_PORT", "5432"),
+        # Seconds to keep connections open between requests, 0 to close them after each request
+        "CONN_MAX_AGE": int(os.environ.get("SQL_CONN_MAX_AGE", 60)),
+    }
+}
+
+# Read-only views (the Grafana API) read from the "replica" database when it is configured: a streaming replica of
+# the default database on SQL_REPLICA_HOST, or a read-only copy of the SQLite default database at
+# SQL_REPLICA_SNAPSHOT, refreshed every SQL_REPLICA_SNAPSHOT_SECONDS
+REPLICA_SNAPSHOT = os.environ.get("SQL_REPLICA_SNAPSHOT")
+REPLICA_SNAPSHOT_SECONDS = int(os.environ.get("SQL_REPLICA_SNAPSHOT_SECONDS", 60))
+
+if os.environ.get("SQL_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.environ.get("SQL_REPLICA_HOST"),
+        "PORT": os.environ.get("SQL_REPLICA_PORT", DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+elif REPLICA_SNAPSHOT:
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": f"{pathlib.Path(REPLICA_SNAPSHOT).absolute().as_uri()}?mode=ro",
+        "CONN_MAX_AGE": DATABASES["default"]["CONN_MAX_AGE"],
+        "TEST": {"MIRROR": "default"},
     }
+
+DATABASE_ROUTERS = ['savings.routers.ReplicaRouter']
+
+# Check that persistent connections still work at the start of each request, reconnecting those that don't
+SQL_HEALTH_CHECKS = bool(int(os.environ.get("SQL_HEALTH_CHECKS", 1)))
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Responses to Grafana queries, use a shared backend for worker processes to share them
+    "grafana": {
+        "BACKEND": os.environ.get("GRAFANA_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("GRAFANA_CACHE_LOCATION", "grafana"),
+        "TIMEOUT": None,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("GRAFANA_CACHE_ENTRIES", 256)),
+        },
+    },
 }
 
 
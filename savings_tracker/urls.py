@@ -23,4 +23,10 @@ urlpatterns = [
     path('search', views.search),
     path('query', views.query),
     path('annotations', views.annotations),
+    path('tag-keys', views.tag_keys),
+    path('tag-values', views.tag_values),
+    path('cache', views.cache),
+    path('metrics', views.prometheus),
+    path('health', views.health),
+    path('ingest', views.ingest),
 ]